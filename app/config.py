@@ -93,6 +93,22 @@ ROLE_PERMISSIONS = {
 ENABLE_AUDIT_LOGGING = os.environ.get("ENABLE_AUDIT_LOGGING", "True").lower() == "true"
 AUDIT_LOG_DIR = os.path.join(BASE_DIR, "data", "audit_logs")
 
+def _parse_sample_rates(value):
+    """Parse "action=rate,..." into a dict of rates clamped to [0, 1], skipping malformed entries."""
+    rates = {}
+    for item in value.split(","):
+        if not item.strip():
+            continue
+        action, _, rate = item.partition("=")
+        try:
+            rates[action.strip()] = min(1.0, max(0.0, float(rate)))
+        except ValueError:
+            print(f"Warning: Ignoring malformed AUDIT_SAMPLE_RATES entry: {item!r}")
+    return rates
+
+# Fraction of data events logged per action, e.g. "upload=0.5,submit=0.1"; unlisted actions are always logged
+AUDIT_SAMPLE_RATES = _parse_sample_rates(os.environ.get("AUDIT_SAMPLE_RATES", ""))
+
 # Amazon S3 settings (for scalable storage)
 AWS_ACCESS_KEY = os.environ.get("AWS_ACCESS_KEY", "")
 AWS_SECRET_KEY = os.environ.get("AWS_SECRET_KEY", "")
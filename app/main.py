@@ -2,51 +2,79 @@
 Main application file for the Legal Sanctions RAG system.
 """
 
-from flask import Flask, render_template, request, jsonify, session, after_this_request, g, redirect, url_for, Response, stream_with_context
+from flask import Flask, Request, render_template, request, jsonify, session, g, redirect, url_for, Response, stream_with_context, send_file
 from flask_cors import CORS
 from flask_jwt_extended import JWTManager, create_access_token, create_refresh_token, jwt_required, get_jwt_identity, verify_jwt_in_request, decode_token
-from functools import wraps
+from functools import wraps, partial, lru_cache
+from contextlib import contextmanager, closing
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import itertools
 import os
 import chromadb
 from chromadb.config import Settings
+from chromadb.db.base import UniqueConstraintError
 import uuid
 import werkzeug
 import time
 import re
 import json
 from werkzeug.utils import secure_filename
-from langchain_community.embeddings import HuggingFaceEmbeddings
-from transformers import pipeline
-import torch
-from unstructured.partition.pdf import partition_pdf
 import dotenv
 import shutil
-from datetime import datetime
+from datetime import datetime, timezone
+from collections import defaultdict
 import nltk
 from app.models.chat import ChatStorage
-import PyPDF2
 import io
 import tempfile
-from PIL import Image
+import sqlite3
 import secrets
+import threading
+import queue
+import atexit
+import weakref
+import logging
 try:
-    import pytesseract
-    PYTESSERACT_AVAILABLE = True
+    import orjson
+    ORJSON_AVAILABLE = True
 except ImportError:
-    PYTESSERACT_AVAILABLE = False
+    ORJSON_AVAILABLE = False
+try:
+    import fcntl  # POSIX only
+    FCNTL_AVAILABLE = True
+except ImportError:
+    FCNTL_AVAILABLE = False
+
+def _json_bytes(obj, indent=False):
+    """Serialize obj to UTF-8 JSON bytes, using orjson when it is installed."""
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else None)
+    return json.dumps(obj, indent=2 if indent else None).encode()
+
+def _json_loads(raw):
+    """Parse JSON from bytes or str, using orjson when it is installed."""
+    return orjson.loads(raw) if ORJSON_AVAILABLE else json.loads(raw)
 
 # Load environment variables
 dotenv.load_dotenv()
 
-# Download necessary NLTK data
-try:
-    nltk.download('punkt', quiet=True)
-    nltk.download('averaged_perceptron_tagger', quiet=True)
-    # For English only
-    nltk.download('maxent_ne_chunker', quiet=True)
-    nltk.download('words', quiet=True)
-except Exception as e:
-    print(f"Warning: NLTK download error: {str(e)}")
+logger = logging.getLogger(__name__)
+
+# NLTK data used by the app (package name -> resource path); English only
+NLTK_RESOURCES = {
+    'punkt': 'tokenizers/punkt',
+    'averaged_perceptron_tagger': 'taggers/averaged_perceptron_tagger',
+    'maxent_ne_chunker': 'chunkers/maxent_ne_chunker',
+    'words': 'corpora/words',
+}
+
+def _ensure_nltk_data():
+    """Download any missing NLTK data (a no-op when NLTK_DATA is pre-populated)."""
+    for package, resource in NLTK_RESOURCES.items():
+        try:
+            nltk.data.find(resource)
+        except LookupError:
+            nltk.download(package, quiet=True)
 
 # Local imports
 from app.config import (
@@ -66,6 +94,7 @@ from app.config import (
 )
 from app.utils.deepseek_client import DeepSeekClient
 from app.utils.openrouter_client import OpenRouterClient
+from app.utils.pdf_extraction import robust_extract_text_from_pdf, hash_file, extract_upload_pages, dataset_pdf_chunks, get_extraction_pool
 
 app = Flask(__name__)
 app.secret_key = SECRET_KEY
@@ -73,18 +102,58 @@ app.secret_key = SECRET_KEY
 app.config['PERMANENT_SESSION_LIFETIME'] = 60 * 60 * 24 * 31  # 31 days in seconds
 CORS(app)
 
+# Names of the built-in datasets, which cannot be modified or deleted
+DEFAULT_DATASET_NAMES = frozenset(d['name'] for d in DEFAULT_DATASETS)
+
 # Initialize Chroma
 chroma_client = chromadb.PersistentClient(path=CHROMA_DIR)
 
+# WAL lets readers run alongside the writer; NORMAL sync is crash-safe under WAL
+# and fsyncs only at checkpoints. journal_mode is stored in the database file,
+# the other two are per connection.
+SQLITE_CONNECTION_PRAGMAS = ("PRAGMA synchronous = NORMAL", "PRAGMA temp_store = MEMORY")
+
+def _tune_chroma_sqlite(client):
+    """Switch Chroma's SQLite database to WAL and tune each pooled connection."""
+    try:
+        pool = client._server._sysdb._conn_pool
+    except AttributeError:
+        print("Warning: Chroma SQLite pool not found, skipping PRAGMA tuning")
+        return
+    pool.connect().execute("PRAGMA journal_mode = WAL")
+
+    # Chroma opens one connection per thread, so tune them as they are handed out
+    connect = pool.connect
+    tuned = weakref.WeakSet()
+    def tuned_connect(*args, **kwargs):
+        conn = connect(*args, **kwargs)
+        if conn not in tuned:
+            for pragma in SQLITE_CONNECTION_PRAGMAS:
+                conn.execute(pragma)
+            tuned.add(conn)
+        return conn
+    pool.connect = tuned_connect
+
+_tune_chroma_sqlite(chroma_client)
+
 # Set HNSW parameters for better performance with larger datasets
+# ef_search is the default; recall-critical queries can raise it per query via
+# query_dataset(ef_search=...). Keep ef_search well above n_results: requesting
+# more than 5 results should come with a higher ef_search.
 HNSW_CONFIG = {
-    "M": 128,  # Maximum number of connections per element
-    "ef_construction": 400,  # Size of the dynamic candidate list during construction
-    "ef_search": 200  # Size of the dynamic candidate list during search
+    "M": 32,  # Maximum number of connections per element
+    "ef_construction": 200,  # Size of the dynamic candidate list during construction
+    "ef_search": 64  # Size of the dynamic candidate list during search
 }
 
-# Initialize embeddings
-embeddings = HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL)
+# Chroma reads HNSW parameters from collection metadata. Chroma 0.4.x keeps
+# vectors as fp32 with no scalar/product quantization, so index memory is
+# governed by M (graph edges per node) and the embedding dimension.
+HNSW_METADATA = {
+    "hnsw:M": HNSW_CONFIG["M"],
+    "hnsw:construction_ef": HNSW_CONFIG["ef_construction"],
+    "hnsw:search_ef": HNSW_CONFIG["ef_search"]
+}
 
 # Initialize the OpenRouter client with the new DeepSeek model
 print(f"Using OpenRouter with model: deepseek/deepseek-chat-v3-0324:free")
@@ -94,8 +163,32 @@ llm_client = OpenRouterClient(
     model="deepseek/deepseek-chat-v3-0324:free"
 )
 
-# Check for GPU
-device = "cuda" if torch.cuda.is_available() else "cpu"
+# Static part of the default system prompt. Built once and kept byte-identical
+# across requests so provider-side prefix caching can reuse it; only the
+# retrieved context is appended per request.
+SYSTEM_PREFIX = """You are a legal expert.
+
+# Instructions
+- Use the provided context to analyze the user's question thoroughly
+- Implement chain-of-thought reasoning by breaking down your analysis step by step
+- First carefully examine the relevant sections from the provided context
+- Think about what legal principles apply to this situation
+- Consider multiple perspectives and interpretations if applicable
+- Draw connections between different parts of the context
+- Formulate a comprehensive and legally sound analysis
+- Cite specific articles, sections, or provisions when possible
+- Clearly separate your reasoning process from your final conclusion
+- If you don't know the answer or it's not in the context, state this clearly
+
+# Output Format
+Structure your response with these sections:
+1. SOURCES: A brief bulleted list of the most relevant source documents you're drawing from
+2. ANALYSIS: Your step-by-step reasoning about the question (this should be detailed)
+3. APPLICABLE PROVISIONS: Specific articles, sections, or legal provisions that apply
+4. CONCLUSION: Your final answer based on the analysis
+
+# Context
+"""
 
 # Initialize JWT manager for authentication
 jwt = JWTManager(app)
@@ -105,11 +198,12 @@ app.config['JWT_REFRESH_TOKEN_EXPIRES'] = int(os.environ.get("JWT_REFRESH_TOKEN_
 
 # Import and initialize additional components
 from app.models.user import User
-from app.utils.audit_logger import AuditLogger
+from app.utils.audit_logger import AsyncAuditLogger
 from app.utils.feedback import FeedbackManager
 from app.utils.credit_system import CreditSystem
 from app.utils.encryption import DocumentEncryption
 from app.utils.secure_processor import SecureDocumentProcessor
+from app.utils.document_processor import LegalDocumentProcessor, warm_query_embedding_model, get_or_create_hnsw_collection
 
 # Initialize user management
 user_manager = User()
@@ -117,9 +211,19 @@ user_manager = User()
 # Initialize audit logger
 from app.config import ENABLE_AUDIT_LOGGING, MAIL_SERVER, MAIL_PORT, MAIL_USERNAME, MAIL_PASSWORD
 from app.config import MAIL_DEFAULT_SENDER, MAIL_FEEDBACK_RECIPIENT, MAIL_USE_TLS, DOCUMENT_ENCRYPTION_KEY
+from app.config import AUDIT_SAMPLE_RATES
 
 # Create audit logger
-audit_logger = AuditLogger(enabled=os.environ.get("ENABLE_AUDIT_LOGGING", "True").lower() == "true")
+audit_logger = AsyncAuditLogger(
+    enabled=os.environ.get("ENABLE_AUDIT_LOGGING", "True").lower() == "true",
+    sample_rates=AUDIT_SAMPLE_RATES
+)
+
+@app.before_request
+def capture_request_identity():
+    """Resolve the client address and session cookie once for audit logging."""
+    g.remote_addr = request.remote_addr
+    g.session_id = request.cookies.get('session')
 
 # Initialize feedback manager
 feedback_manager = FeedbackManager(
@@ -144,36 +248,401 @@ else:
     print("Using environment variable for encryption key")
 
 document_encryption = DocumentEncryption(key=os.environ.get("DOCUMENT_ENCRYPTION_KEY", DOCUMENT_ENCRYPTION_KEY))
+
+@lru_cache(maxsize=1)
+def get_doc_processor():
+    """Return the document processor shared by all routes.
+
+    Its embedding model and compute device (CUDA or CPU) are resolved lazily,
+    so torch is not imported until a model is needed.
+    """
+    return LegalDocumentProcessor(
+        embedding_model=EMBEDDING_MODEL,
+        chroma_path=CHROMA_DIR
+    )
+
+# Share the document processor so the process holds a single copy of the embedding model
 secure_processor = SecureDocumentProcessor(
     encryption_handler=document_encryption,
     embedding_model=EMBEDDING_MODEL,
     chroma_path=CHROMA_DIR,
-    device=device
+    doc_processor=get_doc_processor()
 )
 
+# Set once NLTK data and the query embedding model are loaded; reported by /healthz
+models_ready = threading.Event()
+
+def _warmup():
+    """Load NLTK data and the query embedding model off the request path.
+
+    Chroma embeds documents and queries with its default MiniLM model, so that is
+    the model warmed here; the HuggingFace EMBEDDING_MODEL is never loaded.
+    """
+    try:
+        _ensure_nltk_data()
+    except Exception as e:
+        print(f"Warning: NLTK download error: {str(e)}")
+    try:
+        warm_query_embedding_model()
+        models_ready.set()
+        print("Model warmup complete")
+    except Exception as e:
+        print(f"Error during model warmup: {str(e)}")
+
+threading.Thread(target=_warmup, name="model-warmup", daemon=True).start()
+
 # Initialize chat storage
 chat_storage = ChatStorage()
 
 # Define base directory
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 DATASET_METADATA_FILE = os.path.join(BASE_DIR, "data", "dataset_metadata.json")
+# Files from DOCUMENTS_DIR already indexed, per dataset: {dataset: {filename: {sha256, mtime_ns, size, processed_at_ns}}}
+DOCUMENTS_MANIFEST_FILE = os.path.join(BASE_DIR, "data", "manifest.json")
+
+# Dataset metadata is a JSON snapshot plus an append-only NDJSON log of changes
+# made since the snapshot was written; compacted at startup once the log grows long.
+DATASET_METADATA_LOG = os.path.join(BASE_DIR, "data", "dataset_metadata.log.jsonl")
+# Advisory lock serializing log appends and compaction across worker processes
+DATASET_METADATA_LOCK_FILE = os.path.join(BASE_DIR, "data", "dataset_metadata.lock")
+os.makedirs(os.path.dirname(DATASET_METADATA_LOCK_FILE), exist_ok=True)
+METADATA_LOG_COMPACT_LINES = 1000
+
+# Parsed dataset metadata, reused while the snapshot and log are unchanged
+_dataset_metadata_cache = {"stamp": None, "data": {}}
+
+# Metadata changes are applied to the cache at once and appended to the log in
+# one write per METADATA_FLUSH_DELAY window, so bursts of updates share a write
+METADATA_FLUSH_DELAY = 0.2
+_metadata_lock = threading.RLock()
+_pending_metadata_lines = []
+_metadata_flush_timer = None
+
+def _file_stamp(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+def _metadata_stamp():
+    return (_file_stamp(DATASET_METADATA_FILE), _file_stamp(DATASET_METADATA_LOG))
+
+@contextmanager
+def _metadata_file_lock(exclusive=True):
+    """Hold the metadata lock file, shared for reads and exclusive for writes.
+
+    flock locks belong to an open file, so a process must not take this lock
+    again while already holding it.
+    """
+    if not FCNTL_AVAILABLE:
+        yield
+        return
+    with open(DATASET_METADATA_LOCK_FILE, 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        yield  # Closing the file releases the lock
+
+def _apply_metadata_event(metadata, event):
+    if event.get("op") == "delete":
+        metadata.pop(event["name"], None)
+    else:
+        metadata[event["name"]] = event.get("data", {})
+
+def _read_metadata_files():
+    """Replay the snapshot and log from disk. Caller holds the metadata file lock."""
+    metadata = {}
+    try:
+        with open(DATASET_METADATA_FILE, 'rb') as f:
+            raw = f.read()
+        metadata = _json_loads(raw)
+    except (IOError, ValueError):
+        pass
+    try:
+        with open(DATASET_METADATA_LOG, 'rb') as f:
+            for line in f:
+                try:
+                    event = _json_loads(line)
+                except ValueError:
+                    continue  # Skip a torn trailing line
+                _apply_metadata_event(metadata, event)
+    except IOError:
+        pass
+    return metadata
 
 # Helper functions for dataset metadata
 def load_dataset_metadata():
-    if not os.path.exists(DATASET_METADATA_FILE):
-        return {}
+    with _metadata_lock:
+        return _load_dataset_metadata()
+
+def _load_dataset_metadata():
+    if _pending_metadata_lines:
+        # Unwritten changes live only in the cache, which stays authoritative until they
+        # are flushed, unless another process has written since: then write ours and replay
+        if _metadata_stamp() == _dataset_metadata_cache["stamp"]:
+            return _dataset_metadata_cache["data"]
+        flush_dataset_metadata()
+    if _metadata_stamp() == _dataset_metadata_cache["stamp"]:
+        return _dataset_metadata_cache["data"]
+    with _metadata_file_lock(exclusive=False):
+        stamp = _metadata_stamp()
+        metadata = _read_metadata_files()
+    _dataset_metadata_cache["stamp"] = stamp
+    _dataset_metadata_cache["data"] = metadata
+    return metadata
+
+def append_metadata_event(name, payload, op="upsert"):
+    """Record a change to one dataset's metadata as a single log line.
+
+    Args:
+        name: Dataset name
+        payload: The dataset's complete metadata dict (ignored for deletes)
+        op: "upsert" to store payload as the dataset's metadata, or "delete"
+    """
+    global _metadata_flush_timer
+    event = {"name": name, "op": op, "data": payload}
+    line = _json_bytes(event) + b"\n"
+    with _metadata_lock:
+        # Bring the cache up to date with other writers before applying our change
+        metadata = _load_dataset_metadata()
+        _apply_metadata_event(metadata, event)
+        _pending_metadata_lines.append(line)
+        if _metadata_flush_timer is None:
+            _metadata_flush_timer = threading.Timer(METADATA_FLUSH_DELAY, flush_dataset_metadata)
+            _metadata_flush_timer.daemon = True
+            _metadata_flush_timer.start()
+
+def flush_dataset_metadata():
+    """Append pending metadata changes to the log in a single write."""
+    global _metadata_flush_timer
+    with _metadata_lock:
+        _metadata_flush_timer = None
+        if not _pending_metadata_lines:
+            return
+        try:
+            with _metadata_file_lock():
+                stamp_before = _metadata_stamp()
+                with open(DATASET_METADATA_LOG, 'ab') as f:
+                    f.write(b"".join(_pending_metadata_lines))
+                stamp_after = _metadata_stamp()
+        except IOError:
+            # Keep the changes pending; the next change schedules another attempt
+            print(f"Error: Could not append dataset metadata to {DATASET_METADATA_LOG}")
+            return
+        _pending_metadata_lines.clear()
+        # The cache only matches the files if nobody else wrote since it was loaded;
+        # otherwise forget the stamp so the next load replays their changes too
+        if stamp_before == _dataset_metadata_cache["stamp"]:
+            _dataset_metadata_cache["stamp"] = stamp_after
+        else:
+            _dataset_metadata_cache["stamp"] = None
+
+atexit.register(flush_dataset_metadata)
+
+def compact_dataset_metadata():
+    """Fold the metadata log into the JSON snapshot once it exceeds METADATA_LOG_COMPACT_LINES.
+
+    Runs under the exclusive metadata file lock, so no other worker can append
+    between reading the log and removing it.
+    """
+    with _metadata_lock, _metadata_file_lock():
+        try:
+            with open(DATASET_METADATA_LOG, 'rb') as f:
+                if sum(1 for _ in f) <= METADATA_LOG_COMPACT_LINES:
+                    return
+        except IOError:
+            return
+        metadata = _read_metadata_files()
+        try:
+            # Compact JSON unless the app runs in debug mode, where a readable snapshot helps
+            data = _json_bytes(metadata, indent=app.debug)
+            # Write to a temp file and rename so readers never see a partial file
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(DATASET_METADATA_FILE), suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, DATASET_METADATA_FILE)
+            os.remove(DATASET_METADATA_LOG)
+        except IOError:
+            print(f"Error: Could not compact dataset metadata into {DATASET_METADATA_FILE}")
+        _dataset_metadata_cache["stamp"] = None
+
+compact_dataset_metadata()
+
+# Timestamps in dataset metadata are stored as integer nanoseconds (time.time_ns())
+# and only formatted as ISO 8601 when sent to clients. A dataset's stamp only changes
+# when it is written, so listings keep formatting the same values; cache them.
+@lru_cache(maxsize=1024)
+def iso(ns):
+    """Format a time.time_ns() timestamp as a UTC ISO 8601 string."""
+    return datetime.fromtimestamp(ns / 1e9, tz=timezone.utc).isoformat()
+
+def _touch_metadata(metadata):
+    """Stamp a dataset metadata entry as updated now."""
+    metadata["last_update_ns"] = time.time_ns()
+    metadata.pop("last_update_date", None)  # Superseded ISO string from older entries
+
+def _last_update_iso(metadata):
+    """ISO last-update time of a dataset metadata entry, or None."""
+    if "last_update_ns" in metadata:
+        return iso(metadata["last_update_ns"])
+    return metadata.get("last_update_date")
+
+# Chroma collection handles by dataset name, shared by all requests in this process.
+# A handle is bound to its collection's id, so each lookup checks the id is still live:
+# another worker may have deleted and recreated the dataset.
+_collection_cache = {}
+_collection_cache_lock = threading.Lock()
+
+def _live_collection_id(name):
+    """Return the current id of a collection, or None if it does not exist.
+
+    Reads Chroma's system database directly, which is one indexed SQLite query
+    and sees changes made by other processes.
+    """
+    collections = chroma_client._server._sysdb.get_collections(
+        name=name, tenant=chroma_client.tenant, database=chroma_client.database
+    )
+    return collections[0]["id"] if collections else None
+
+def _get_collection(name, create=False):
+    """Return the cached handle for a Chroma collection, looking it up when missing or stale.
+
+    Args:
+        name: Collection name
+        create: Create the collection if it does not exist
+
+    Returns:
+        The collection handle; raises like chroma_client.get_collection if it is
+        missing and create is False.
+    """
+    with _collection_cache_lock:
+        collection = _collection_cache.get(name)
+        if collection is not None and collection.id == _live_collection_id(name):
+            return collection
+        if create:
+            collection = get_or_create_hnsw_collection(chroma_client, name)
+        else:
+            collection = chroma_client.get_collection(name=name)
+        _collection_cache[name] = collection
+        return collection
+
+def _cache_collection(collection):
+    """Remember a collection handle returned by create_collection."""
+    with _collection_cache_lock:
+        _collection_cache[collection.name] = collection
+
+def _forget_collection(name):
+    """Drop a collection's cached handle, e.g. after the collection is deleted."""
+    with _collection_cache_lock:
+        _collection_cache.pop(name, None)
+
+def _scan_sources(collection):
+    """Return the set of source filenames referenced by a collection's chunks.
+
+    This reads every chunk's metadata, so it is only used to seed or rebuild
+    the "sources" list kept in the dataset metadata.
+    """
+    results = collection.get(include=["metadatas"])
+    return {meta.get("source") for meta in results["metadatas"] if meta.get("source")}
+
+def _known_sources(metadata, collection):
+    """Return a dataset's tracked source filenames, scanning the collection once if untracked."""
+    if "sources" in metadata:
+        return set(metadata["sources"])
+    return _scan_sources(collection)
+
+def _store_sources(name, metadata, sources):
+    """Persist a dataset's source filenames and the document count derived from them."""
+    metadata["sources"] = sorted(sources)
+    metadata["document_count"] = len(sources)
+    _touch_metadata(metadata)
+    append_metadata_event(name, metadata)
+
+def _refresh_doc_count(name, collection=None):
+    """Recount the unique documents in a dataset and store the count in its metadata.
+
+    Called after a bulk re-index so that listing datasets can read
+    document_count without scanning the collection.
+    """
+    if collection is None:
+        collection = _get_collection(name)
+    dataset_metadata = load_dataset_metadata()
+    _store_sources(name, dataset_metadata.setdefault(name, {}), _scan_sources(collection))
+
+# Chroma add() batches: embedding runs outside the GIL, so batches overlap across threads.
+# Larger batches mean fewer SQLite commits per ingest, up to the most Chroma accepts per call.
+ADD_BATCH_SIZE = min(1000, chroma_client.max_batch_size)
+ADD_WORKERS = 4
+# Streaming ingests also flush once a buffer holds this much text, whichever limit is hit first
+ADD_BATCH_MAX_CHARS = 8 * 1024 * 1024
+
+def _add_in_batches(collection, documents, metadatas, ids):
+    """Add chunks to a collection in batches spread over a small thread pool.
+
+    Yields (batches_done, total_batches) as each batch completes, so streaming
+    routes can report progress; other callers just exhaust the generator.
+    """
+    batches = [
+        (documents[i:i+ADD_BATCH_SIZE], metadatas[i:i+ADD_BATCH_SIZE], ids[i:i+ADD_BATCH_SIZE])
+        for i in range(0, len(documents), ADD_BATCH_SIZE)
+    ]
+    if not batches:
+        return
+    with ThreadPoolExecutor(max_workers=min(ADD_WORKERS, len(batches))) as executor:
+        futures = [
+            executor.submit(collection.add, documents=batch_docs, metadatas=batch_meta, ids=batch_ids)
+            for batch_docs, batch_meta, batch_ids in batches
+        ]
+        for done, future in enumerate(as_completed(futures), start=1):
+            future.result()
+            yield done, len(batches)
+
+def load_documents_manifest():
     try:
-        with open(DATASET_METADATA_FILE, 'r') as f:
-            return json.load(f)
-    except (IOError, json.JSONDecodeError):
+        with open(DOCUMENTS_MANIFEST_FILE, 'rb') as f:
+            raw = f.read()
+        return _json_loads(raw)
+    except (IOError, ValueError):
         return {}
 
-def save_dataset_metadata(metadata):
+def save_documents_manifest(manifest):
     try:
-        with open(DATASET_METADATA_FILE, 'w') as f:
-            json.dump(metadata, f, indent=2)
+        data = _json_bytes(manifest)
+        # Write to a temp file and rename so readers never see a partial file
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(DOCUMENTS_MANIFEST_FILE), suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, DOCUMENTS_MANIFEST_FILE)
     except IOError:
-        print(f"Error: Could not save dataset metadata to {DATASET_METADATA_FILE}")
+        print(f"Error: Could not save documents manifest to {DOCUMENTS_MANIFEST_FILE}")
+
+def _scan_changed_documents(entries):
+    """Return the documents in DOCUMENTS_DIR that are new or changed since they were indexed.
+
+    Args:
+        entries: Manifest entries for the dataset, keyed by filename.
+
+    Returns:
+        List of (filename, path, stat, sha256) tuples, sorted by filename. sha256
+        is None when the file is new to the manifest and has not been hashed yet.
+    """
+    changed = []
+    with os.scandir(DOCUMENTS_DIR) as it:
+        for entry in it:
+            if not entry.is_file() or not entry.name.endswith(('.pdf', '.txt')):
+                continue
+            stat = entry.stat()
+            known = entries.get(entry.name)
+            if known and known["mtime_ns"] == stat.st_mtime_ns and known["size"] == stat.st_size:
+                continue
+            sha256 = None
+            if known:
+                # Touched but identical content: just record the new mtime
+                sha256 = hash_file(entry.path)
+                if sha256 == known["sha256"]:
+                    known["mtime_ns"] = stat.st_mtime_ns
+                    continue
+            changed.append((entry.name, entry.path, stat, sha256))
+    return sorted(changed)
 
 # Configure file uploads
 UPLOAD_FOLDER = os.path.join(BASE_DIR, "data", "uploads")
@@ -187,86 +656,168 @@ os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = MAX_CONTENT_LENGTH
 
+SPOOL_MAX_MEMORY = 500 * 1024  # Multipart files larger than this are spooled to disk
+SPOOL_STALE_SECONDS = 3600  # .part files untouched this long belong to a killed worker
+# Only these endpoints keep their uploads via _save_upload; everything else (notably the
+# secure upload route) keeps Werkzeug's anonymous, already-unlinked temp files
+SPOOL_ENDPOINTS = {'upload_documents', 'upload_documents_to_dataset'}
+
+class UploadSpoolRequest(Request):
+    """Request that spools large multipart files inside UPLOAD_FOLDER.
+
+    Werkzeug spools them to the system temp directory, so saving an upload meant
+    copying every byte a second time. A spool next to the destination can be
+    hard-linked into place by _save_upload instead.
+    """
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if self.endpoint not in SPOOL_ENDPOINTS:
+            return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+        if total_content_length is None or total_content_length > SPOOL_MAX_MEMORY:
+            return tempfile.NamedTemporaryFile('wb+', dir=app.config['UPLOAD_FOLDER'], suffix='.part')
+        return io.BytesIO()
+
+def _sweep_stale_spools():
+    """Remove .part spools left behind when a worker was killed mid-upload.
+
+    Runs in every worker at import, so only files idle for SPOOL_STALE_SECONDS are
+    removed; a spool still being written by a live worker keeps a fresh mtime.
+    """
+    cutoff = time.time() - SPOOL_STALE_SECONDS
+    for entry in os.scandir(UPLOAD_FOLDER):
+        if not entry.name.endswith('.part'):
+            continue
+        try:
+            if entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+                print(f"Removed stale upload spool: {entry.name}")
+        except OSError:
+            pass
+
+_sweep_stale_spools()
+
+app.request_class = UploadSpoolRequest
+
+# Characters not allowed in Chroma collection names; each becomes its own '-', matching
+# the names produced by the earlier per-character loop
+_SANITIZE_RE = re.compile(r'[^A-Za-z0-9_-]')
+
+def sanitize_dataset_name(dataset_name):
+    """Turn a user-supplied name into a valid collection name (3-60 chars, alphanumeric at both ends)."""
+    # Stripping '-_' leaves an alphanumeric first character; only truncation can expose a bad last one
+    sanitized_name = _SANITIZE_RE.sub('-', dataset_name).strip('-_')[:60]
+    if len(sanitized_name) < 3:
+        return f"dataset-{int(time.time())}"
+    if not sanitized_name[-1].isalnum():
+        sanitized_name = sanitized_name[:-1] + 'x'
+    return sanitized_name
+
 def allowed_file(filename):
     """Check if the file has an allowed extension."""
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def robust_extract_text_from_pdf(pdf_path):
-    """Extract text from PDF using multiple methods for better reliability."""
-    # Store all extracted text
-    all_text = []
-    extraction_success = False
-    
-    # METHOD 1: Using unstructured library (works well for many PDFs)
-    try:
-        print(f"Trying unstructured partition for {pdf_path}")
-        # Try without extract_images_in_pdf parameter first
+_SENTENCE_END_RE = re.compile(r'(?<=[.!?])\s+')
+
+def _approx_tokens(text):
+    """Rough token count for English text (about 4 characters per token)."""
+    return len(text) // 4 + 1
+
+def iter_chunks(pieces, max_tokens=500, overlap_sents=1):
+    """Pack the sentences of successive text pieces into chunks of up to about max_tokens tokens.
+
+    Sentences are packed greedily; each chunk starts with the last overlap_sents
+    sentences of the previous one, dropping as many of them as needed to stay
+    within max_tokens. A single sentence longer than max_tokens becomes its own chunk. Pieces are sentence-tokenized one at a time, so a
+    long document can be fed in paragraph by paragraph.
+
+    Args:
+        pieces: Iterable of text strings (e.g. paragraphs), in document order
+        max_tokens: Approximate token budget per chunk
+        overlap_sents: Number of sentences repeated at the start of the next chunk
+
+    Yields:
+        Chunk strings
+    """
+    buf, buf_tokens, fresh = [], 0, 0  # fresh: sentences not already in the previous chunk
+    for piece in pieces:
         try:
-            elements = partition_pdf(pdf_path, strategy="hi_res")
-        except TypeError:
-            # If that fails, try with older version parameters
-            elements = partition_pdf(pdf_path)
-            
-        for element in elements:
-            if hasattr(element, 'text') and element.text:
-                all_text.append(element.text)
-                extraction_success = True
-    except Exception as e:
-        print(f"Error with unstructured partition: {str(e)}")
-    
-    # If first method got text, return it
-    if extraction_success and len(''.join(all_text).strip()) > 100:
-        print(f"Successfully extracted text using unstructured partition")
-        return all_text
-    
-    # METHOD 2: Using PyPDF2 (good for text-based PDFs)
-    try:
-        print(f"Trying PyPDF2 for {pdf_path}")
-        pdf_text = []
-        with open(pdf_path, 'rb') as file:
-            pdf_reader = PyPDF2.PdfReader(file)
-            if len(pdf_reader.pages) > 0:
-                for page_num in range(len(pdf_reader.pages)):
-                    page = pdf_reader.pages[page_num]
-                    text = page.extract_text()
-                    if text and text.strip():
-                        pdf_text.append(f"Page {page_num+1}: {text}")
-                        extraction_success = True
-        
-        # If we got text, add it to all_text
-        if extraction_success:
-            all_text.extend(pdf_text)
-            print(f"Successfully extracted text using PyPDF2")
-    except Exception as e:
-        print(f"Error with PyPDF2: {str(e)}")
-    
-    # METHOD 3: Using OCR if available and needed
-    if not extraction_success and PYTESSERACT_AVAILABLE:
+            sentences = nltk.sent_tokenize(piece)
+        except LookupError:
+            # Punkt data not downloaded yet (see _ensure_nltk_data)
+            sentences = _SENTENCE_END_RE.split(piece)
+        for sentence in sentences:
+            sentence = sentence.strip()
+            if not sentence:
+                continue
+            sentence_tokens = _approx_tokens(sentence)
+            if fresh and buf_tokens + sentence_tokens > max_tokens:
+                yield " ".join(buf)
+                buf = buf[-overlap_sents:] if overlap_sents else []
+                buf_tokens = sum(_approx_tokens(s) for s in buf)
+                # Drop overlap sentences that would push the next chunk over budget
+                while buf and buf_tokens + sentence_tokens > max_tokens:
+                    buf_tokens -= _approx_tokens(buf.pop(0))
+                fresh = 0
+            buf.append(sentence)
+            buf_tokens += sentence_tokens
+            fresh += 1
+    if fresh:
+        yield " ".join(buf)
+
+TEXT_READ_BLOCK = 1024 * 1024  # Characters read per block from text files
+
+def iter_paragraphs(file_path, errors='strict'):
+    """Yield the blank-line separated paragraphs of a UTF-8 text file.
+
+    The file is read in TEXT_READ_BLOCK blocks with the trailing partial
+    paragraph carried over, so memory stays proportional to the block size
+    rather than the file size. A paragraph longer than a block is cut at its
+    last line break (or the block end).
+    """
+    carry = ""
+    with open(file_path, 'r', encoding='utf-8', errors=errors) as f:
+        for block in iter(lambda: f.read(TEXT_READ_BLOCK), ''):
+            paragraphs = (carry + block).split('\n\n')
+            carry = paragraphs.pop()
+            yield from paragraphs
+            if len(carry) > TEXT_READ_BLOCK:
+                cut = carry.rfind('\n') + 1 or len(carry)
+                yield carry[:cut]
+                carry = carry[cut:]
+    if carry:
+        yield carry
+
+UPLOAD_COPY_BUFFER = 1024 * 1024  # Bytes per read/write when saving uploads
+
+def _save_upload(file, file_path):
+    """Write an uploaded file to disk, linking its spool file when possible.
+
+    Large uploads are already on disk in UPLOAD_FOLDER (see UploadSpoolRequest), so a
+    hard link is a metadata-only save. Otherwise the bytes are copied with 1 MiB reads
+    and writes; FileStorage.save copies in 16 KiB chunks, which is syscall-heavy.
+    """
+    spool_path = getattr(file.stream, 'name', None)
+    if isinstance(spool_path, str):
         try:
-            print(f"Trying OCR for {pdf_path}")
-            # Convert PDF to images and OCR
-            from pdf2image import convert_from_path
-            
-            ocr_text = []
-            images = convert_from_path(pdf_path)
-            for i, image in enumerate(images):
-                text = pytesseract.image_to_string(image)
-                if text and text.strip():
-                    ocr_text.append(f"Page {i+1} (OCR): {text}")
-                    extraction_success = True
-            
-            if extraction_success:
-                all_text.extend(ocr_text)
-                print(f"Successfully extracted text using OCR")
-        except Exception as e:
-            print(f"Error with OCR: {str(e)}")
-    
-    # If no text was extracted, add a message
-    if not extraction_success or not all_text:
-        print(f"Could not extract any text from {pdf_path}")
-        return []
-    
-    return all_text
+            file.stream.flush()
+            if os.path.exists(file_path):
+                os.remove(file_path)
+            os.link(spool_path, file_path)
+            return
+        except OSError:
+            pass  # e.g. a different filesystem; fall back to copying
+    with open(file_path, 'wb', buffering=UPLOAD_COPY_BUFFER) as out:
+        shutil.copyfileobj(file.stream, out, length=UPLOAD_COPY_BUFFER)
+
+def _dataset_text_chunks(path, filename, index):
+    """Yield the chunks of one text file uploaded to an existing dataset.
+
+    Yields:
+        (text, metadata, chunk_id) tuples for chunks with more than 50 characters.
+    """
+    for j, chunk in enumerate(iter_chunks(iter_paragraphs(path, errors='ignore'))):
+        if len(chunk) > 50:
+            yield chunk, {"source": filename, "page": 1}, f"{filename}_{index}_{j}"
 
 @app.route('/')
 def index():
@@ -286,9 +837,16 @@ def index():
                           available_models=AVAILABLE_MODELS,
                           last_active_chat=last_active_chat)
 
+@app.route('/healthz')
+def healthz():
+    """Readiness check: report ready only once the models have been loaded."""
+    if not models_ready.is_set():
+        return jsonify({"status": "warming_up"}), 503
+    return jsonify({"status": "ready"})
+
 @app.route('/api/chat', methods=['POST'])
 def chat():
-    """Process chat messages and return AI responses with relevant context."""
+    """Process chat messages and stream AI responses, followed by their sources, as server-sent events."""
     data = request.json
     user_message = data.get('message', '')
     dataset_name = data.get('dataset', 'EU-Sanctions')
@@ -301,7 +859,7 @@ def chat():
         session['session_id'] = str(uuid.uuid4())
     
     # Retrieve context from Chroma based on user query
-    collection = chroma_client.get_or_create_collection(name=dataset_name)
+    collection = _get_collection(dataset_name, create=True)
     
     # Get the document count to determine how many results we can request
     doc_count = collection.count()
@@ -314,15 +872,7 @@ def chat():
             'metadatas': [[{"source": "System", "page": 0}]]
         }
     else:
-        # Import the document processor for advanced querying
-        from app.utils.document_processor import LegalDocumentProcessor
-        
-        # Initialize document processor with the same settings as configured globally
-        doc_processor = LegalDocumentProcessor(
-            embedding_model=EMBEDDING_MODEL,
-            chroma_path=CHROMA_DIR,
-            device=device
-        )
+        doc_processor = get_doc_processor()
         
         # Use advanced query with hybrid search and reranking
         results = doc_processor.query_dataset(
@@ -345,30 +895,7 @@ def chat():
         }
         sources.append(source_info)
     
-    system_message = f"""You are a legal expert.
-    
-    # Instructions
-    - Use the provided context to analyze the user's question thoroughly
-    - Implement chain-of-thought reasoning by breaking down your analysis step by step
-    - First carefully examine the relevant sections from the provided context
-    - Think about what legal principles apply to this situation
-    - Consider multiple perspectives and interpretations if applicable
-    - Draw connections between different parts of the context
-    - Formulate a comprehensive and legally sound analysis
-    - Cite specific articles, sections, or provisions when possible
-    - Clearly separate your reasoning process from your final conclusion
-    - If you don't know the answer or it's not in the context, state this clearly
-    
-    # Output Format
-    Structure your response with these sections:
-    1. SOURCES: A brief bulleted list of the most relevant source documents you're drawing from
-    2. ANALYSIS: Your step-by-step reasoning about the question (this should be detailed)
-    3. APPLICABLE PROVISIONS: Specific articles, sections, or legal provisions that apply
-    4. CONCLUSION: Your final answer based on the analysis
-    
-    # Context
-    {context}
-    """
+    system_message = SYSTEM_PREFIX + context
     
     # Format the conversation history
     formatted_history = []
@@ -376,103 +903,97 @@ def chat():
         if msg["role"] in ["user", "assistant"]:
             formatted_history.append({"role": msg["role"], "content": msg["content"]})
     
-    try:
-        # Log the full prompt for debugging
-        print("\n--- LLM PROMPT DEBUG ---")
-        print("System message:")
-        print(system_message)
-        print("\nChat history:")
-        print(formatted_history[-10:] if formatted_history else [])
-        print("--- END LLM PROMPT DEBUG ---\n")
-        # Call LLM API with enhanced prompt
-        response = llm_client.generate_with_rag(
-            query=user_message,
-            context=system_message,  # Pass the complete system message with instructions
-            chat_history=formatted_history[-10:] if formatted_history else [],  # Use last 5 turns (10 messages)
-            temperature=0.1  # Lower temperature for more analytical responses
-        )
-    except Exception as e:
-        print(f"Error calling LLM API: {str(e)}")
-        response = "I'm sorry, I encountered an error processing your request. Please try again later."
-        
+    # Build the messages for the LLM: instructions, the last 5 turns (10 messages), then the question
+    messages = [{"role": "system", "content": system_message}]
+    messages.extend(formatted_history[-10:])
+    messages.append({"role": "user", "content": user_message})
+    
     # Add source information to the response context
     source_context = "\n\n".join([f"Source: {s['source']} (Page/Section: {s['page']})\nPreview: {s['snippet']}" for s in sources])
     
-    return jsonify({
-        'response': response,
-        'context': source_context,  # Use the formatted source context with citation info
-        'dataset': dataset_name,
-        'raw_context': context  # Include the raw context as well if needed
-    })
+    # Log the full prompt for debugging
+    print("\n--- LLM PROMPT DEBUG ---")
+    print("System message:")
+    print(system_message)
+    print("\nChat history:")
+    print(formatted_history[-10:] if formatted_history else [])
+    print("--- END LLM PROMPT DEBUG ---\n")
+    
+    def generate():
+        try:
+            # Stream the LLM response with the enhanced prompt
+            for chunk in llm_client.stream_with_rag(
+                query=user_message,
+                context="",  # Retrieved context is already in the system message
+                chat_history=messages,
+                temperature=0.1  # Lower temperature for more analytical responses
+            ):
+                yield b"data: " + _json_bytes({'chunk': chunk}) + b"\n\n"
+        except Exception as e:
+            print(f"Error calling LLM API: {str(e)}")
+            error_message = "I'm sorry, I encountered an error processing your request. Please try again later."
+            yield b"data: " + _json_bytes({'error': error_message}) + b"\n\n"
+        
+        # Send citations once, after the answer has streamed
+        yield b"data: " + _json_bytes({'done': True, 'context': source_context, 'sources': sources, 'dataset': dataset_name, 'raw_context': context}) + b"\n\n"
+    
+    return Response(stream_with_context(generate()), mimetype='text/event-stream')
 
 @app.route('/api/datasets', methods=['GET'])
 def get_datasets():
-    """Return available datasets."""
+    """Stream available datasets as NDJSON, one dataset object per line."""
     # List collections in Chroma
     try:
         collections = chroma_client.list_collections()
-        collection_names = [c.name for c in collections]
-        
-        # Debug output
-        print(f"Found Chroma collections: {collection_names}")
-        
-        # Combine with default datasets
-        all_datasets = []
         dataset_metadata = load_dataset_metadata()
-        
+    except Exception as e:
+        print(f"Error fetching datasets: {str(e)}")
+        # Fallback to default datasets
+        fallback = {"name": "Default", "description": "Default dataset (error occurred)", "is_custom": False}
+        return Response(_json_bytes(fallback) + b"\n", mimetype='application/x-ndjson')
+
+    # Debug output
+    print(f"Found Chroma collections: {len(collections)}")
+
+    def generate():
+        existing = set()
+
         # Add custom datasets first
-        for name in collection_names:
-            # Count documents in collection
+        for collection in collections:
+            name = collection.name
+            existing.add(name)
             try:
-                coll = chroma_client.get_collection(name=name)
-                # Get all documents from collection to count unique sources
-                results = coll.get(include=["metadatas"])
-                unique_sources = set()
-                for meta in results["metadatas"]:
-                    source = meta.get("source")
-                    if source:
-                        unique_sources.add(source)
-                doc_count = len(unique_sources)  # Count unique documents
                 metadata = dataset_metadata.get(name, {})
-                description = metadata.get("description", f"Custom dataset with {doc_count} entries")
-                author = metadata.get("author")
-                topic = metadata.get("topic")
-                linkedin_url = metadata.get("linkedin_url")
-                custom_instructions = metadata.get("custom_instructions")
-                last_update_date = metadata.get("last_update_date")
-                # Use document_count from metadata if available, otherwise use our calculated doc_count
-                document_count = metadata.get("document_count", doc_count)
-                all_datasets.append({
-                    "name": name, 
-                    "description": description,
-                    "author": author,
-                    "topic": topic,
-                    "linkedin_url": linkedin_url,
-                    "custom_instructions": custom_instructions,
-                    "last_update_date": last_update_date,
+                # Use the cached document_count; fall back to the (cheap) chunk count for untracked datasets
+                document_count = metadata.get("document_count")
+                if document_count is None:
+                    document_count = collection.count()
+                dataset = {
+                    "name": name,
+                    "description": metadata.get("description", f"Custom dataset with {document_count} entries"),
+                    "author": metadata.get("author"),
+                    "topic": metadata.get("topic"),
+                    "linkedin_url": metadata.get("linkedin_url"),
+                    "custom_instructions": metadata.get("custom_instructions"),
+                    "last_update_date": _last_update_iso(metadata),
                     "document_count": document_count,
                     "is_custom": True
-                })
+                }
             except Exception as e:
                 print(f"Error getting collection info for {name}: {str(e)}")
-                description = dataset_metadata.get(name, {}).get("description", "Custom dataset")
-                all_datasets.append({
-                    "name": name, 
-                    "description": description,
+                dataset = {
+                    "name": name,
+                    "description": dataset_metadata.get(name, {}).get("description", "Custom dataset"),
                     "is_custom": True
-                })
-        
+                }
+            yield _json_bytes(dataset) + b"\n"
+
         # Then add default datasets that aren't already in the list
         for dataset in DEFAULT_DATASETS:
-            if not any(d['name'] == dataset['name'] for d in all_datasets):
-                dataset["is_custom"] = False
-                all_datasets.append(dataset)
-        
-        return jsonify(all_datasets)
-    except Exception as e:
-        print(f"Error fetching datasets: {str(e)}")
-        # Fallback to default datasets
-        return jsonify([{"name": "Default", "description": "Default dataset (error occurred)", "is_custom": False}])
+            if dataset['name'] not in existing:
+                yield _json_bytes({**dataset, "is_custom": False}) + b"\n"
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
 
 @app.route('/api/datasets', methods=['POST'])
 def create_dataset():
@@ -487,34 +1008,20 @@ def create_dataset():
             return jsonify({"error": "Dataset name is required"}), 400
 
         # Sanitize the dataset name
-        sanitized_name = ''.join(c if c.isalnum() or c in '-_' else '-' for c in dataset_name)
-        sanitized_name = sanitized_name.strip('-_')
-        
-        if len(sanitized_name) > 60:
-            sanitized_name = sanitized_name[:60]
-        if len(sanitized_name) < 3:
-            sanitized_name = f"dataset-{int(time.time())}"
-        if not sanitized_name[0].isalnum():
-            sanitized_name = 'x' + sanitized_name[1:]
-        if not sanitized_name[-1].isalnum():
-            sanitized_name = sanitized_name[:-1] + 'x'
-
-        # Check if dataset already exists
+        sanitized_name = sanitize_dataset_name(dataset_name)
+
+        # Create the collection; Chroma rejects names that already exist
         try:
-            chroma_client.get_collection(name=sanitized_name)
+            collection = chroma_client.create_collection(
+                name=sanitized_name,
+                metadata=HNSW_METADATA
+            )
+        except UniqueConstraintError:
             return jsonify({"error": f"Dataset '{sanitized_name}' already exists"}), 400
-        except Exception:
-            # Collection doesn't exist, which is what we want
-            pass
-
-        # Create the collection
-        collection = chroma_client.create_collection(
-            name=sanitized_name,
-            hnsw_config=HNSW_CONFIG
-        )
+        _cache_collection(collection)
 
         # Store metadata
-        current_time = datetime.now().isoformat()
+        now_ns = time.time_ns()
         dataset_metadata = load_dataset_metadata()
         dataset_metadata[sanitized_name] = {
             "description": data.get('description', ''),
@@ -522,11 +1029,12 @@ def create_dataset():
             "topic": data.get('topic', ''),
             "linkedin_url": data.get('linkedin_url', ''),
             "custom_instructions": data.get('custom_instructions', ''),
-            "created_at": current_time,
-            "last_update_date": current_time,
-            "document_count": 0
+            "created_at_ns": now_ns,
+            "last_update_ns": now_ns,
+            "document_count": 0,
+            "sources": []
         }
-        save_dataset_metadata(dataset_metadata)
+        append_metadata_event(sanitized_name, dataset_metadata[sanitized_name])
 
         return jsonify({
             "success": True,
@@ -540,7 +1048,7 @@ def create_dataset():
                 "custom_instructions": data.get('custom_instructions', ''),
                 "is_custom": True,
                 "document_count": 0,
-                "last_update_date": current_time
+                "last_update_date": iso(now_ns)
             }
         })
 
@@ -551,38 +1059,38 @@ def create_dataset():
 @app.route('/api/datasets/<dataset_name>', methods=['DELETE'])
 def delete_dataset(dataset_name):
     """Delete a dataset by name."""
-    if dataset_name in [d['name'] for d in DEFAULT_DATASETS]:
+    if dataset_name in DEFAULT_DATASET_NAMES:
         return jsonify({"error": "Cannot delete default dataset"}), 400
     
     deleted_from_chroma = False
     deletion_messages = []
     
-    try:
-        # Attempt to delete from Chroma
-        chroma_client.delete_collection(name=dataset_name)
-        deleted_from_chroma = True 
-        deletion_messages.append(f"Collection '{dataset_name}' deleted from ChromaDB.")
-        print(f"Successfully deleted collection '{dataset_name}' from ChromaDB.")
-    except Exception as e:
-        # Check if the collection still exists. If not, it's effectively deleted.
+    # Attempt to delete from Chroma, only if the collection exists
+    existing = {c.name for c in chroma_client.list_collections()}
+    if dataset_name in existing:
         try:
-            chroma_client.get_collection(name=dataset_name)
-            # If it's still here, then the deletion failed for a more serious reason
+            _forget_collection(dataset_name)
+            chroma_client.delete_collection(name=dataset_name)
+            deleted_from_chroma = True 
+            deletion_messages.append(f"Collection '{dataset_name}' deleted from ChromaDB.")
+            print(f"Successfully deleted collection '{dataset_name}' from ChromaDB.")
+        except Exception as e:
             error_msg = f"Failed to delete collection '{dataset_name}' from ChromaDB: {str(e)}"
             deletion_messages.append(error_msg)
             print(error_msg)
-        except Exception:
-            # Collection was not found by get_collection, so it's effectively gone from Chroma
-            deleted_from_chroma = True 
-            msg = f"Collection '{dataset_name}' not found in ChromaDB (considered successfully removed)."
-            deletion_messages.append(msg)
-            print(msg)
+    else:
+        # Collection is not in Chroma, so it's effectively gone
+        deleted_from_chroma = True 
+        msg = f"Collection '{dataset_name}' not found in ChromaDB (considered successfully removed)."
+        deletion_messages.append(msg)
+        print(msg)
             
+    _dataset_docs_cache.pop(dataset_name, None)
+
     # Attempt to delete from metadata
     dataset_metadata = load_dataset_metadata()
     if dataset_name in dataset_metadata:
-        del dataset_metadata[dataset_name]
-        save_dataset_metadata(dataset_metadata)
+        append_metadata_event(dataset_name, None, op="delete")
         deleted_from_metadata = True
         msg = f"Dataset '{dataset_name}' deleted from metadata."
         deletion_messages.append(msg)
@@ -617,7 +1125,7 @@ def update_dataset_metadata_route(dataset_name):
 
     # Check if dataset exists in Chroma
     try:
-        collection = chroma_client.get_collection(name=dataset_name)
+        collection = _get_collection(dataset_name)
         exists_in_chroma = True
         # Get document count from Chroma
         results = collection.get(include=["metadatas"])
@@ -634,25 +1142,25 @@ def update_dataset_metadata_route(dataset_name):
     if dataset_name not in dataset_metadata:
         # If dataset exists in Chroma but not in metadata, auto-create a minimal entry
         if exists_in_chroma:
-            current_time = datetime.now().isoformat()
+            now_ns = time.time_ns()
             dataset_metadata[dataset_name] = {
                 "description": "",
                 "author": "",
                 "topic": "",
                 "linkedin_url": "",
                 "custom_instructions": "",
-                "created_at": current_time,
-                "last_update_date": current_time,
+                "created_at_ns": now_ns,
+                "last_update_ns": now_ns,
                 "document_count": doc_count  # Use the document count from Chroma
             }
-            save_dataset_metadata(dataset_metadata)
+            append_metadata_event(dataset_name, dataset_metadata[dataset_name])
             print(f"[DEBUG] Auto-created metadata entry for dataset: '{dataset_name}' with document_count: {doc_count}")
         else:
             # If dataset does not exist in Chroma, return 404
             return jsonify({"error": "Dataset not found"}), 404
 
     # Also check if it's a default dataset, which shouldn't be "updated" via this mechanism
-    if any(d['name'] == dataset_name for d in DEFAULT_DATASETS):
+    if dataset_name in DEFAULT_DATASET_NAMES:
         return jsonify({"error": "Default datasets cannot be modified."}), 403
 
     # Update only the allowed fields
@@ -661,7 +1169,7 @@ def update_dataset_metadata_route(dataset_name):
     current_meta["description"] = data_to_update.get("description", current_meta.get("description", ""))
     current_meta["author"] = data_to_update.get("author", current_meta.get("author", ""))
     current_meta["topic"] = data_to_update.get("topic", current_meta.get("topic", ""))
-    current_meta["last_update_date"] = datetime.now().isoformat()  # Update the last update date
+    _touch_metadata(current_meta)  # Update the last update date
     
     linkedin_url = data_to_update.get("linkedin_url", "")
     if linkedin_url:
@@ -676,7 +1184,7 @@ def update_dataset_metadata_route(dataset_name):
         current_meta.pop("custom_instructions", None)
 
     dataset_metadata[dataset_name] = current_meta
-    save_dataset_metadata(dataset_metadata)
+    append_metadata_event(dataset_name, current_meta)
 
     return jsonify({"success": True, "message": f"Dataset '{dataset_name}' updated successfully."})
 
@@ -689,12 +1197,7 @@ def process_documents():
     dataset_name = request.json.get('dataset_name', 'EU-Sanctions')
     
     # Create or get collection
-    collection = chroma_client.get_or_create_collection(name=dataset_name)
-    
-    # Process PDF files
-    documents = []
-    metadatas = []
-    ids = []
+    collection = _get_collection(dataset_name, create=True)
     
     # Check if directory exists
     if not os.path.exists(DOCUMENTS_DIR):
@@ -705,21 +1208,29 @@ def process_documents():
             "dataset": dataset_name
         })
     
-    # List document files (PDF and TXT)
-    doc_files = [f for f in os.listdir(DOCUMENTS_DIR) if f.endswith(('.pdf', '.txt'))][:10]
+    # Only index files that are new or changed since the last run for this dataset
+    manifest = load_documents_manifest()
+    manifest_entries = manifest.setdefault(dataset_name, {})
+    doc_files = _scan_changed_documents(manifest_entries)
+    chunk_count = 0
     
     # Handle case where no documents exist
-    if not doc_files:
+    if not doc_files and not manifest_entries:
         # Add some sample data for testing
         sample_text = "This is a sample document for the EU Sanctions dataset. The European Union imposes sanctions or restrictive measures in pursuit of the specific objectives of the Common Foreign and Security Policy (CFSP). Sanctions are preventative, non-punitive instruments which aim to bring about a change in policy or activity by targeting non-EU countries, entities, and individuals responsible for the malign behavior at stake."
-        documents.append(sample_text)
-        metadatas.append({"source": "sample_document.txt", "page": 1})
-        ids.append(f"sample_document_0_1")
-    
-    # Process document files
-    for i, doc_file in enumerate(doc_files):
-        file_path = os.path.join(DOCUMENTS_DIR, doc_file)
-        
+        collection.upsert(
+            documents=[sample_text],
+            metadatas=[{"source": "sample_document.txt", "page": 1}],
+            ids=["sample_document_0_1"]
+        )
+        chunk_count += 1
+    
+    # Process document files one at a time: each file's chunks are stored and its
+    # manifest entry saved before the next starts, so an interrupted run keeps its progress
+    for doc_file, file_path, stat, sha256 in doc_files:
+        documents = []
+        metadatas = []
+        ids = []
         try:
             if doc_file.endswith('.pdf'):
                 # Use robust PDF extraction method
@@ -730,53 +1241,49 @@ def process_documents():
                     if text and len(text) > 50:  # Skip very short segments
                         documents.append(text)
                         metadatas.append({"source": doc_file, "page": j})
-                        ids.append(f"{doc_file}_{i}_{j}")
+                        ids.append(f"{doc_file}_{j}")
             elif doc_file.endswith('.txt'):
                 # Read text file directly
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    text = f.read()
-                    
-                # Split text into paragraphs or chunks
-                chunks = [t.strip() for t in text.split('\n\n') if t.strip()]
-                
-                for j, chunk in enumerate(chunks):
+                # Stream the file through the sentence packer
+                for j, chunk in enumerate(iter_chunks(iter_paragraphs(file_path))):
                     if len(chunk) > 50:  # Skip very short segments
                         documents.append(chunk)
                         metadatas.append({"source": doc_file, "part": j})
-                        ids.append(f"{doc_file}_{i}_{j}")
-                        
-                # If no chunks (single paragraph), add the whole text
-                if not chunks and len(text) > 50:
-                    documents.append(text)
-                    metadatas.append({"source": doc_file, "part": 0})
-                    ids.append(f"{doc_file}_{i}_0")
-                    
+                        ids.append(f"{doc_file}_{j}")
+            
+            # Drop every chunk of this file before re-indexing it, including chunks stored
+            # before the manifest existed (under older id schemes)
+            collection.delete(where={"source": doc_file})
+            for _ in _add_in_batches(collection, documents, metadatas, ids):
+                pass
+            chunk_count += len(documents)
+            
+            # Record the file only once its chunks are stored
+            manifest_entries[doc_file] = {
+                "sha256": sha256 or hash_file(file_path),
+                "mtime_ns": stat.st_mtime_ns,
+                "size": stat.st_size,
+                "processed_at_ns": time.time_ns()
+            }
+            save_documents_manifest(manifest)
         except Exception as e:
             print(f"Error processing {file_path}: {str(e)}")
     
-    # Add to Chroma
-    # In real implementation, use embeddings model to vectorize
-    for i in range(0, len(documents), 100):  # Batch processing
-        batch_docs = documents[i:i+100]
-        batch_meta = metadatas[i:i+100]
-        batch_ids = ids[i:i+100]
-        
-        collection.add(
-            documents=batch_docs,
-            metadatas=batch_meta,
-            ids=batch_ids
-        )
-    
     # Store dataset description
     dataset_description = request.json.get('dataset_description', '')
     if dataset_description:
         dataset_metadata = load_dataset_metadata()
         dataset_metadata[dataset_name] = {"description": dataset_description}
-        save_dataset_metadata(dataset_metadata)
+        append_metadata_event(dataset_name, dataset_metadata[dataset_name])
+    
+    _refresh_doc_count(dataset_name, collection)
+    _dataset_docs_cache.pop(dataset_name, None)
+    # Touched-but-unchanged files only had their mtime updated by the scan
+    save_documents_manifest(manifest)
     
     return jsonify({
         "status": "success",
-        "message": f"Processed {len(documents)} text chunks from {len(doc_files)} documents",
+        "message": f"Processed {chunk_count} text chunks from {len(doc_files)} documents",
         "dataset": dataset_name
     })
 
@@ -786,7 +1293,7 @@ def upload_documents():
     def generate_progress():
         try:
             if 'files' not in request.files:
-                yield json.dumps({"status": "error", "message": "No files uploaded"}) + "\n"
+                yield _json_bytes({"status": "error", "message": "No files uploaded"}) + b"\n"
                 return
             
             # Get dataset name and sanitize it for ChromaDB requirements
@@ -798,68 +1305,63 @@ def upload_documents():
             dataset_custom_instructions = request.form.get('dataset_custom_instructions', '')
             
             # Sanitize the dataset name
-            sanitized_name = ''.join(c if c.isalnum() or c in '-_' else '-' for c in dataset_name)
-            sanitized_name = sanitized_name.strip('-_')
-            
-            if len(sanitized_name) > 60:
-                sanitized_name = sanitized_name[:60]
-            if len(sanitized_name) < 3:
-                sanitized_name = f"dataset-{int(time.time())}"
-            if not sanitized_name[0].isalnum():
-                sanitized_name = 'x' + sanitized_name[1:]
-            if not sanitized_name[-1].isalnum():
-                sanitized_name = sanitized_name[:-1] + 'x'
+            sanitized_name = sanitize_dataset_name(dataset_name)
             
             dataset_name = sanitized_name
             
-            # Check if dataset already exists
+            # Create collection; Chroma rejects names that already exist
             try:
-                chroma_client.get_collection(name=dataset_name)
-                yield json.dumps({"status": "error", "message": f"Dataset '{dataset_name}' already exists"}) + "\n"
+                collection = chroma_client.create_collection(
+                    name=sanitized_name,
+                    metadata=HNSW_METADATA
+                )
+            except UniqueConstraintError:
+                yield _json_bytes({"status": "error", "message": f"Dataset '{dataset_name}' already exists"}) + b"\n"
                 return
-            except Exception:
-                # Collection doesn't exist, which is what we want
-                pass
-
-            # Create collection
-            collection = chroma_client.create_collection(
-                name=sanitized_name,
-                hnsw_config=HNSW_CONFIG
-            )
+            _cache_collection(collection)
             
             # Process uploaded files
             files = request.files.getlist('files')
             total_documents = len(files)
-            documents = []
-            metadatas = []
-            ids = []
             
+            # Chunks are added to Chroma as soon as a batch fills, so memory stays
+            # bounded by ADD_BATCH_SIZE and inserts start while PDFs are still extracting
+            batch = {"docs": [], "meta": [], "ids": []}
+            
+            def flush_batch():
+                if batch["docs"]:
+                    collection.add(documents=batch["docs"], metadatas=batch["meta"], ids=batch["ids"])
+                    batch["docs"], batch["meta"], batch["ids"] = [], [], []
+            
+            def add_chunk(text, meta, chunk_id):
+                batch["docs"].append(text)
+                batch["meta"].append(meta)
+                batch["ids"].append(chunk_id)
+                if len(batch["docs"]) >= ADD_BATCH_SIZE:
+                    flush_batch()
+            
+            # PDF extraction is CPU-bound, so spread files across processes. Each PDF is
+            # submitted as soon as it is saved, so saving the next upload overlaps with
+            # extracting the previous ones; text files are read inline.
+            executor = get_extraction_pool()
+            futures = {}
             for i, file in enumerate(files):
                 if file and allowed_file(file.filename):
                     filename = secure_filename(file.filename)
                     file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                    file.save(file_path)
+                    _save_upload(file, file_path)
+                    
+                    if filename.endswith('.pdf'):
+                        futures[executor.submit(extract_upload_pages, file_path, filename)] = (i, filename)
+                        continue
                     
                     try:
-                        if filename.endswith('.pdf'):
-                            extracted_texts = robust_extract_text_from_pdf(file_path)
-                            for j, text in enumerate(extracted_texts):
-                                if text and len(text) > 50:
-                                    documents.append(text)
-                                    metadatas.append({"source": filename, "page": j + 1})
-                                    ids.append(f"{filename}_{i}_{j}")
-                        elif filename.endswith('.txt'):
-                            with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                                text = f.read()
-                            chunks = [t.strip() for t in text.split('\n\n') if t.strip()]
-                            for j, chunk in enumerate(chunks):
+                        if filename.endswith('.txt'):
+                            for j, chunk in enumerate(iter_chunks(iter_paragraphs(file_path, errors='ignore'))):
                                 if len(chunk) > 50:
-                                    documents.append(chunk)
-                                    metadatas.append({"source": filename, "page": 1})
-                                    ids.append(f"{filename}_{i}_{j}")
+                                    add_chunk(chunk, {"source": filename, "page": 1}, f"{filename}_{i}_{j}")
                     except Exception as e:
                         print(f"Error processing {filename}: {str(e)}")
-                        continue
                     
                     # Clean up the file after processing
                     try:
@@ -867,19 +1369,24 @@ def upload_documents():
                     except Exception as e:
                         print(f"Error removing temporary file {file_path}: {str(e)}")
             
-            # Add to Chroma in batches
-            for i in range(0, len(documents), 100):
-                batch_docs = documents[i:i+100]
-                batch_meta = metadatas[i:i+100]
-                batch_ids = ids[i:i+100]
-                collection.add(
-                    documents=batch_docs,
-                    metadatas=batch_meta,
-                    ids=batch_ids
-                )
+            for done, future in enumerate(as_completed(futures), start=1):
+                i, filename = futures[future]
+                try:
+                    for j, (text, page) in enumerate(future.result()):
+                        add_chunk(text, {"source": filename, "page": page}, f"{filename}_{i}_{j}")
+                except Exception as e:
+                    print(f"Error processing {filename}: {str(e)}")
+                yield _json_bytes({
+                    "progress": 0.9 * done / len(futures),
+                    "status": f"Extracted {filename} ({done}/{len(futures)})"
+                }) + b"\n"
+            
+            # Add the remaining partial batch
+            flush_batch()
+            _dataset_docs_cache.pop(dataset_name, None)
             
             # Update dataset metadata
-            current_time = datetime.now().isoformat()
+            now_ns = time.time_ns()
             dataset_metadata = load_dataset_metadata()
             dataset_metadata[dataset_name] = {
                 "description": dataset_description,
@@ -887,17 +1394,17 @@ def upload_documents():
                 "topic": dataset_topic,
                 "linkedin_url": dataset_linkedin,
                 "custom_instructions": dataset_custom_instructions,
-                "created_at": current_time,
-                "last_update_date": current_time,
+                "created_at_ns": now_ns,
+                "last_update_ns": now_ns,
                 "document_count": total_documents
             }
-            save_dataset_metadata(dataset_metadata)
+            append_metadata_event(dataset_name, dataset_metadata[dataset_name])
             
-            yield json.dumps({"progress": 1.0, "status": "Processing complete!"}) + "\n"
+            yield _json_bytes({"progress": 1.0, "status": "Processing complete!"}) + b"\n"
             
         except Exception as e:
             print(f"Error in upload_documents: {str(e)}")
-            yield json.dumps({"status": "error", "message": str(e)}) + "\n"
+            yield _json_bytes({"status": "error", "message": str(e)}) + b"\n"
     
     return Response(stream_with_context(generate_progress()), mimetype='application/x-ndjson')
 
@@ -940,10 +1447,9 @@ def rename_folder_route(folder_id):
 
     # Save folders
     # chat_storage does not have a save_folders, so we update the file directly
-    import os, json
     folders_file = os.path.join(chat_storage.storage_dir, "folders.json")
-    with open(folders_file, 'w') as f:
-        json.dump({"folders": folders}, f, indent=2)
+    with open(folders_file, 'wb') as f:
+        f.write(_json_bytes({"folders": folders}, indent=app.debug))
 
     return jsonify({'success': True})
 
@@ -954,10 +1460,8 @@ def delete_folder_route(folder_id):
         return jsonify({'error': 'Cannot delete the default folder'}), 400
 
     # First, move all chats in this folder to the default folder
-    chats = chat_storage.list_chats()
-    for chat in chats:
-        if chat.get('folder_id') == folder_id:
-            chat_storage.move_chat_to_folder(chat['id'], 'default')
+    for chat in chat_storage.list_chats(folder_id):
+        chat_storage.move_chat_to_folder(chat['id'], 'default')
 
     # Then delete the folder
     success = chat_storage.delete_folder(folder_id)
@@ -1018,33 +1522,34 @@ def get_chat(chat_id):
     if chat is None:
         return jsonify({"error": "Chat not found"}), 404
     
+    _merge_stream_log(chat_id, chat)
+    
     # Validate and sanitize messages to ensure they're correctly formatted
     if 'messages' in chat:
-        # Log message count for debugging
-        print(f"Chat {chat_id} has {len(chat['messages'])} messages")
+        # Format checks below only feed debug logs; skip them unless DEBUG is on
+        debug = logger.isEnabledFor(logging.DEBUG)
+        if debug:
+            logger.debug("Chat %s has %d messages", chat_id, len(chat['messages']))
         
         # Filter out any messages with missing/invalid content
         valid_messages = []
         for msg in chat['messages']:
             # Ensure messages have required fields
             if 'role' not in msg or 'content' not in msg or not msg['content']:
-                print(f"Skipping invalid message in chat {chat_id}: {msg}")
+                logger.debug("Skipping invalid message in chat %s: %s", chat_id, msg)
                 continue
                 
             # Ensure role is valid
-            if msg['role'] not in ['user', 'assistant', 'system']:
-                print(f"Invalid role in message: {msg['role']}")
+            if msg['role'] not in ('user', 'assistant', 'system'):
+                logger.debug("Invalid role in message: %s", msg['role'])
                 msg['role'] = 'system'  # Default to system for invalid roles
                 
-            # Ensure assistant messages have proper formatting
-            if msg['role'] == 'assistant' and not msg.get('metadata', {}).get('isSystem', False):
-                # Check if AI response has the expected format
-                has_sources = "SOURCES:" in msg['content']
-                has_analysis = "ANALYSIS:" in msg['content']
-                
-                # If message doesn't have expected format, log it
-                if not (has_sources or has_analysis):
-                    print(f"Assistant message lacks expected sections: {msg['content'][:100]}...")
+            # Log assistant responses that lack the expected sections
+            if (debug and msg['role'] == 'assistant'
+                    and not msg.get('metadata', {}).get('isSystem', False)
+                    and len(msg['content']) >= 20
+                    and not any(marker in msg['content'] for marker in ("SOURCES:", "ANALYSIS:"))):
+                logger.debug("Assistant message lacks expected sections: %s...", msg['content'][:100])
             
             valid_messages.append(msg)
             
@@ -1067,6 +1572,7 @@ def update_chat_route(chat_id):
 def delete_chat(chat_id):
     """Delete a chat and return the next most recent chat."""
     result = chat_storage.delete_chat(chat_id)
+    _discard_stream_log(chat_id)
     
     if not result["success"]:
         return jsonify({"error": result["message"]}), 404
@@ -1077,6 +1583,11 @@ def delete_chat(chat_id):
         "message": result["message"]
     })
 
+# Partial assistant responses are saved while streaming at most this often (seconds),
+# and only once at least STREAM_SAVE_MIN_CHARS new characters have arrived
+STREAM_SAVE_INTERVAL = 0.5
+STREAM_SAVE_MIN_CHARS = 50
+
 @app.route('/api/chats/<chat_id>/messages', methods=['POST'])
 def add_message(chat_id):
     """Add a message to a chat and stream the response."""
@@ -1094,16 +1605,22 @@ def add_message(chat_id):
         return jsonify({"error": "Chat not found"}), 404
     print(f"[CHAT_API] Chat {chat_id} retrieved.")
     
+    # Collect dataset/model changes so the chat is written once
+    updates = {}
+    
     # Use the chat's dataset if not specified
     if not dataset_name:
         dataset_name = chat.get('dataset', 'Default')
     elif dataset_name != chat.get('dataset'):
         # Update the chat's dataset if it changed
-        chat_storage.update_chat(chat_id, {"dataset": dataset_name})
+        updates["dataset"] = dataset_name
     
     # Update the model if it changed
     if model_name != chat.get('model', MODEL_NAME):
-        chat_storage.update_chat(chat_id, {"model": model_name})
+        updates["model"] = model_name
+    
+    if updates:
+        chat_storage.update_chat(chat_id, updates)
     
     # Load dataset-specific custom instructions
     dataset_metadata = load_dataset_metadata()
@@ -1126,15 +1643,7 @@ def add_message(chat_id):
         if msg['role'] in ['user', 'assistant']:
             history.append({"role": msg['role'], "content": msg['content']})
     
-    # Import the document processor for advanced querying
-    from app.utils.document_processor import LegalDocumentProcessor
-    
-    # Initialize document processor with the same settings as configured globally
-    doc_processor = LegalDocumentProcessor(
-        embedding_model=EMBEDDING_MODEL,
-        chroma_path=CHROMA_DIR,
-        device=device
-    )
+    doc_processor = get_doc_processor()
     
     # Use advanced query with hybrid search and reranking
     results = doc_processor.query_dataset(
@@ -1148,10 +1657,10 @@ def add_message(chat_id):
     # Format the context from retrieved documents
     context = ""
     if results and results['documents']:
-        for doc, meta in zip(results['documents'][0], results['metadatas'][0]):
-            source = meta.get("source", "Unknown")
-            page = meta.get("page", meta.get("part", 0))
-            context += f"Source: {source} (Page {page})\n{doc}\n\n"
+        context = "".join(
+            f"Source: {meta.get('source', 'Unknown')} (Page {meta.get('page', meta.get('part', 0))})\n{doc}\n\n"
+            for doc, meta in zip(results['documents'][0], results['metadatas'][0])
+        )
     
     # Create enhanced prompt for LLM with Chain of Thought reasoning
     if custom_instructions_for_dataset:
@@ -1160,73 +1669,44 @@ def add_message(chat_id):
         print(f"[CHAT_API] Using ONLY custom instructions as system prompt for dataset {dataset_name}")
     else:
         # Use default system message with context
-        system_message = f"""You are a legal expert.
-        
-        # Instructions
-        - Use the provided context to analyze the user's question thoroughly
-        - Implement chain-of-thought reasoning by breaking down your analysis step by step
-        - First carefully examine the relevant sections from the provided context
-        - Think about what legal principles apply to this situation
-        - Consider multiple perspectives and interpretations if applicable
-        - Draw connections between different parts of the context
-        - Formulate a comprehensive and legally sound analysis
-        - Cite specific articles, sections, or provisions when possible
-        - Clearly separate your reasoning process from your final conclusion
-        - If you don't know the answer or it's not in the context, state this clearly
-        
-        # Output Format
-        Structure your response with these sections:
-        1. SOURCES: A brief bulleted list of the most relevant source documents you're drawing from
-        2. ANALYSIS: Your step-by-step reasoning about the question (this should be detailed)
-        3. APPLICABLE PROVISIONS: Specific articles, sections, or legal provisions that apply
-        4. CONCLUSION: Your final answer based on the analysis
-        
-        # Context
-        {context}
-        """
+        system_message = SYSTEM_PREFIX + context
+    
+    # Messages for the LLM: system prompt, prior turns (history holds only user and
+    # assistant messages), then the new question
+    messages = [{"role": "system", "content": system_message}]
+    messages.extend(history)
+    messages.append({"role": "user", "content": user_message})
+    
+    # Streamed response so far, and how much of it has been persisted (and when)
+    full_response = ""
+    saved_response_length = 0
+    last_save = time.monotonic()
     
     def generate():
-        nonlocal full_response, saved_response_length
-        
-        # Prepare messages for the LLM
-        messages = []
-        
-        # Add system message first
-        messages.append({
-            "role": "system",
-            "content": system_message
-        })
-        
-        # Add chat history (excluding system messages)
-        for msg in history:
-            if msg['role'] != 'system':  # Skip system messages as we already added it
-                messages.append(msg)
-        
-        # Add user message
-        messages.append({
-            "role": "user",
-            "content": user_message
-        })
+        nonlocal full_response, saved_response_length, last_save
         
         # Stream the LLM response
         for chunk in llm_client.stream_with_rag(
             query=user_message,
-            context=context,  # Pass the actual context here
+            context="",  # Retrieved context is already in the system message
             chat_history=messages,
             temperature=0.1
         ):
             print(f"[CHAT_API] In generate(): Received chunk: {chunk[:50]}...")
             full_response += chunk
-            yield f"data: {json.dumps({'chunk': chunk})}\n\n"
+            yield b"data: " + _json_bytes({'chunk': chunk}) + b"\n\n"
             
-            if len(full_response) - saved_response_length > 200:
+            # Persist at most every STREAM_SAVE_INTERVAL seconds, whatever the token rate
+            if (time.monotonic() - last_save > STREAM_SAVE_INTERVAL
+                    and len(full_response) - saved_response_length > STREAM_SAVE_MIN_CHARS):
                 update_streaming_message(chat_id, full_response)
                 saved_response_length = len(full_response)
+                last_save = time.monotonic()
                 print(f"[CHAT_API] In generate(): Updated streaming message, now at {saved_response_length} chars")
         
         print("[CHAT_API] In generate(): Finished iterating llm_client.stream_with_rag")
         # Yield a completion event 
-        yield f"data: {json.dumps({'done': True})}\n\n"
+        yield b"data: " + _json_bytes({'done': True}) + b"\n\n"
         
         # Make sure to save the final complete response
         finalize_message(chat_id, full_response)
@@ -1309,8 +1789,8 @@ def auth_required(permission=None):
                 resource_type="api",
                 action=request.method.lower(),
                 status="success",
-                ip_address=request.remote_addr,
-                session_id=request.cookies.get('session')
+                ip_address=g.remote_addr,
+                session_id=g.session_id
             )
             
             return f(*args, **kwargs)
@@ -1345,8 +1825,8 @@ def register():
         user_id=user_id,
         action="register",
         status="success",
-        ip_address=request.remote_addr,
-        session_id=request.cookies.get('session')
+        ip_address=g.remote_addr,
+        session_id=g.session_id
     )
     
     return jsonify({
@@ -1379,8 +1859,8 @@ def login():
             user_id=None,
             action="login",
             status="failure",
-            ip_address=request.remote_addr,
-            session_id=request.cookies.get('session'),
+            ip_address=g.remote_addr,
+            session_id=g.session_id,
             details={"error": error_message, "attempted_login": username_or_email}
         )
         
@@ -1394,8 +1874,8 @@ def login():
         user_id=user["id"],
         action="login",
         status="success",
-        ip_address=request.remote_addr,
-        session_id=request.cookies.get('session')
+        ip_address=g.remote_addr,
+        session_id=g.session_id
     )
     
     # Return user data and tokens
@@ -1440,8 +1920,8 @@ def refresh_token():
                 user_id=user_id,
                 action="token_refresh",
                 status="success",
-                ip_address=request.remote_addr,
-                session_id=request.cookies.get('session')
+                ip_address=g.remote_addr,
+                session_id=g.session_id
             )
             
             return jsonify({
@@ -1467,8 +1947,8 @@ def logout():
         user_id=user.get("id"),
         action="logout",
         status="success",
-        ip_address=request.remote_addr,
-        session_id=request.cookies.get('session')
+        ip_address=g.remote_addr,
+        session_id=g.session_id
     )
     
     return jsonify({"success": True})
@@ -1534,23 +2014,149 @@ def change_password():
         return jsonify({"error": error_message}), 400
     
     # Log password change
-    audit_logger.log_data_event(
-        user_id=user["id"],
-        resource_id=user["id"],
-        resource_type="user",
-        action="change_password",
-        status="success",
-        ip_address=request.remote_addr,
-        session_id=request.cookies.get('session')
-    )
+    if audit_logger.should_sample("change_password"):
+        audit_logger.enqueue_data_event(
+            user_id=user["id"],
+            resource_id=user["id"],
+            resource_type="user",
+            action="change_password",
+            status="success",
+            ip_address=g.remote_addr,
+            session_id=g.session_id
+        )
     
     return jsonify({"success": True})
 
+# Secure uploads are processed by a small worker pool; clients poll the task route.
+# Task state lives in SQLite under data/ so a poll can land on any server process.
+# Finished tasks are kept for SECURE_TASK_TTL seconds.
+SECURE_TASK_WORKERS = 4
+SECURE_TASK_TTL = 60 * 60
+SECURE_TASKS_DB = os.path.join(BASE_DIR, "data", "secure_tasks.sqlite3")
+secure_task_executor = ThreadPoolExecutor(max_workers=SECURE_TASK_WORKERS, thread_name_prefix="secure-upload")
+
+def _secure_task_db():
+    """Open the shared secure task table, creating it on first use.
+
+    `with conn:` only commits, so callers wrap the connection in closing() too.
+    """
+    conn = sqlite3.connect(SECURE_TASKS_DB, timeout=5)
+    try:
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS secure_tasks (task_id TEXT PRIMARY KEY, user_id TEXT, filename TEXT, "
+            "status TEXT, result TEXT, cost INTEGER, pid INTEGER, created_at REAL, updated_at REAL)"
+        )
+    except sqlite3.Error:
+        conn.close()
+        raise
+    return conn
+
+def _update_secure_task(task_id, status, result=None, from_statuses=("pending", "running")):
+    """Move a task to status if it is still in one of from_statuses.
+
+    Returns:
+        Whether this call made the transition, so only one caller acts on it
+    """
+    placeholders = ", ".join("?" * len(from_statuses))
+    with closing(_secure_task_db()) as conn, conn:
+        cursor = conn.execute(
+            f"UPDATE secure_tasks SET status = ?, result = ?, updated_at = ? "
+            f"WHERE task_id = ? AND status IN ({placeholders})",
+            (status, _json_bytes(result).decode() if result is not None else None, time.time(), task_id, *from_statuses)
+        )
+        return cursor.rowcount == 1
+
+def _refund_secure_upload(user_id, processing_cost, filename):
+    """Return the credits reserved for a secure upload that did not complete."""
+    credit_system.add_credits(
+        user_id=user_id,
+        amount=processing_cost,
+        transaction_type="refund",
+        description=f"Refund: document processing failed for {filename}"
+    )
+
+def _process_alive(pid):
+    """Whether the server process that owns a task is still running."""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def _process_secure_upload(task_id, file_obj, dataset_name, filename, user_id, processing_cost, ip_address, session_id):
+    """Encrypt and index one secure upload, recording the outcome (runs in secure_task_executor).
+
+    Credits were deducted when the task was submitted; they are refunded if processing fails.
+
+    Args:
+        task_id: ID of the task row to update
+        file_obj: Spooled copy of the uploaded file
+        dataset_name: Dataset to add the document to
+        filename: Original filename
+        user_id: ID of the uploading user
+        processing_cost: Credits deducted for this upload
+        ip_address: Client address captured from the request
+        session_id: Session cookie captured from the request
+    """
+    try:
+        _update_secure_task(task_id, "running", from_statuses=("pending",))
+        result = secure_processor.memoryless_processing(
+            file_obj=file_obj,
+            ragmodel_name=dataset_name,
+            original_filename=filename,
+            user_id=user_id
+        )
+        
+        # Log document upload
+        if audit_logger.should_sample("upload"):
+            audit_logger.enqueue_data_event(
+                user_id=user_id,
+                resource_id=result["encrypted_id"],
+                resource_type="document",
+                action="upload",
+                status="success",
+                ip_address=ip_address,
+                session_id=session_id,
+                details={"dataset": dataset_name, "filename": filename}
+            )
+        
+        _update_secure_task(task_id, "success", {
+            "message": "Document processed securely",
+            "document_id": result["encrypted_id"],
+            "dataset": dataset_name,
+            "credits_used": processing_cost,
+            "credits_remaining": credit_system.get_user_balance(user_id)
+        })
+    except Exception as e:
+        # Log error
+        audit_logger.log_exception(
+            exception=e,
+            user_id=user_id,
+            resource_type="document",
+            action="upload",
+            ip_address=ip_address,
+            session_id=session_id
+        )
+        if _update_secure_task(task_id, "error", {"error": f"Error processing document: {str(e)}"}):
+            _refund_secure_upload(user_id, processing_cost, filename)
+    finally:
+        file_obj.close()
+
+def _prune_secure_tasks():
+    """Delete finished tasks older than SECURE_TASK_TTL."""
+    with closing(_secure_task_db()) as conn, conn:
+        conn.execute(
+            "DELETE FROM secure_tasks WHERE status IN ('success', 'error') AND updated_at < ?",
+            (time.time() - SECURE_TASK_TTL,)
+        )
+
 # Secure document routes
 @app.route('/api/secure-documents/upload', methods=['POST'])
 @auth_required("write")
 def upload_secure_document():
-    """Upload and process a document securely."""
+    """Accept a document for secure processing and return a task ID to poll."""
     user = g.user
     
     # Check if file was uploaded
@@ -1569,61 +2175,69 @@ def upload_secure_document():
     # Get dataset name from request
     dataset_name = request.form.get('dataset', 'Default')
     
-    # Ensure we have enough credits
+    # Deduct the credits up front so concurrent uploads cannot overspend; a failed
+    # task refunds them
     processing_cost = 5  # Example: 5 credits per document
-    if not credit_system.check_can_afford(user["id"], processing_cost):
+    success, _ = credit_system.deduct_usage(
+        user_id=user["id"],
+        amount=processing_cost,
+        feature="document_processing",
+        description=f"Processing document: {file.filename}"
+    )
+    if not success:
         return jsonify({"error": "Insufficient credits"}), 402  # Payment Required
     
+    task_id = uuid.uuid4().hex
+    spooled = None
     try:
-        # Process document in memory without saving to disk
-        result = secure_processor.memoryless_processing(
-            file_obj=file.stream,
-            dataset_name=dataset_name,
-            original_filename=file.filename,
-            user_id=user["id"]
-        )
-        
-        # Deduct credits for document processing
-        success, new_balance = credit_system.deduct_usage(
-            user_id=user["id"],
-            amount=processing_cost,
-            feature="document_processing",
-            description=f"Processing document: {file.filename}"
-        )
+        # The request's stream is closed when the response is sent, so hand the worker its own copy
+        spooled = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_MEMORY)
+        shutil.copyfileobj(file.stream, spooled, length=UPLOAD_COPY_BUFFER)
+        spooled.seek(0)
         
-        # Log document upload
-        audit_logger.log_data_event(
-            user_id=user["id"],
-            resource_id=result["encrypted_id"],
-            resource_type="document",
-            action="upload",
-            status="success",
-            ip_address=request.remote_addr,
-            session_id=request.cookies.get('session'),
-            details={"dataset": dataset_name, "filename": file.filename}
+        _prune_secure_tasks()
+        now = time.time()
+        with closing(_secure_task_db()) as conn, conn:
+            conn.execute(
+                "INSERT INTO secure_tasks VALUES (?, ?, ?, 'pending', NULL, ?, ?, ?, ?)",
+                (task_id, user["id"], file.filename, processing_cost, os.getpid(), now, now)
+            )
+        secure_task_executor.submit(
+            _process_secure_upload, task_id, spooled, dataset_name, file.filename, user["id"],
+            processing_cost, g.remote_addr, g.session_id
         )
-        
-        return jsonify({
-            "status": "success",
-            "message": "Document processed securely",
-            "document_id": result["encrypted_id"],
-            "dataset": dataset_name,
-            "credits_used": processing_cost,
-            "credits_remaining": new_balance
-        })
-        
     except Exception as e:
-        # Log error
-        audit_logger.log_exception(
-            exception=e,
-            user_id=user["id"],
-            resource_type="document",
-            action="upload",
-            ip_address=request.remote_addr,
-            session_id=request.cookies.get('session')
-        )
-        
+        print(f"Error queueing secure upload {file.filename}: {str(e)}")
+        if spooled is not None:
+            spooled.close()
+        _refund_secure_upload(user["id"], processing_cost, file.filename)
         return jsonify({"error": f"Error processing document: {str(e)}"}), 500
+    
+    return jsonify({"status": "pending", "task_id": task_id}), 202
+
+@app.route('/api/secure-documents/task/<task_id>', methods=['GET'])
+@auth_required("read")
+def get_secure_upload_task(task_id):
+    """Report the status of a secure upload task."""
+    with closing(_secure_task_db()) as conn, conn:
+        row = conn.execute(
+            "SELECT user_id, filename, status, result, cost, pid, created_at FROM secure_tasks WHERE task_id = ?", (task_id,)
+        ).fetchone()
+    if row is None or row[0] != g.user["id"]:
+        return jsonify({"error": "Task not found"}), 404
+    
+    user_id, filename, status, result, cost, pid, created_at = row
+    # A task whose server process was killed (e.g. by the gunicorn timeout) never finishes
+    if status in ("pending", "running") and (not _process_alive(pid) or time.time() - created_at > SECURE_TASK_TTL):
+        error = {"error": "Document processing was interrupted; credits have been refunded"}
+        if _update_secure_task(task_id, "error", error):
+            _refund_secure_upload(user_id, cost, filename)
+        status, result = "error", _json_bytes(error)
+    
+    payload = {"status": status, "task_id": task_id}
+    if result:
+        payload.update(_json_loads(result))
+    return jsonify(payload)
 
 @app.route('/api/secure-documents/<document_id>', methods=['GET'])
 @auth_required("read")
@@ -1646,8 +2260,8 @@ def get_secure_document(document_id):
             resource_type="document",
             action="access",
             status="success",
-            ip_address=request.remote_addr,
-            session_id=request.cookies.get('session')
+            ip_address=g.remote_addr,
+            session_id=g.session_id
         )
         
         return jsonify({
@@ -1673,23 +2287,18 @@ def stream_secure_document(access_token):
         # Stream the document
         file, filename, mimetype = secure_processor.stream_document_securely(access_token)
         
-        # Set up response
-        response = Response(
-            stream_with_context(file.read()),
-            mimetype=mimetype
+        # Serve the decrypted temp file by path so Werkzeug can stream it with
+        # sendfile and answer range/conditional requests, rather than reading it into memory
+        path = file.name
+        file.close()
+        return send_file(
+            path,
+            mimetype=mimetype,
+            as_attachment=False,
+            download_name=filename,
+            conditional=True
         )
         
-        # Set content disposition header to make the browser download the file
-        response.headers["Content-Disposition"] = f'inline; filename="{filename}"'
-        
-        # Make sure to close the file when the response is complete
-        @after_this_request
-        def cleanup(response):
-            file.close()
-            return response
-        
-        return response
-        
     except PermissionError:
         return jsonify({"error": "Invalid or expired access token"}), 403
         
@@ -1713,15 +2322,16 @@ def delete_secure_document(document_id):
             return jsonify({"error": "Document not found"}), 404
         
         # Log document deletion
-        audit_logger.log_data_event(
-            user_id=user["id"],
-            resource_id=document_id,
-            resource_type="document",
-            action="delete",
-            status="success",
-            ip_address=request.remote_addr,
-            session_id=request.cookies.get('session')
-        )
+        if audit_logger.should_sample("delete"):
+            audit_logger.enqueue_data_event(
+                user_id=user["id"],
+                resource_id=document_id,
+                resource_type="document",
+                action="delete",
+                status="success",
+                ip_address=g.remote_addr,
+                session_id=g.session_id
+            )
         
         return jsonify({"success": True})
         
@@ -1791,16 +2401,17 @@ def purchase_credits():
     new_balance = credit_system.get_user_balance(user["id"])
     
     # Log the purchase
-    audit_logger.log_data_event(
-        user_id=user["id"],
-        resource_id=package_id,
-        resource_type="credit_package",
-        action="purchase",
-        status="success",
-        ip_address=request.remote_addr,
-        session_id=request.cookies.get('session'),
-        details={"credits_added": credits_added, "payment_ref": payment_ref}
-    )
+    if audit_logger.should_sample("purchase"):
+        audit_logger.enqueue_data_event(
+            user_id=user["id"],
+            resource_id=package_id,
+            resource_type="credit_package",
+            action="purchase",
+            status="success",
+            ip_address=g.remote_addr,
+            session_id=g.session_id,
+            details={"credits_added": credits_added, "payment_ref": payment_ref}
+        )
     
     return jsonify({
         "success": True,
@@ -1852,15 +2463,16 @@ def submit_user_feedback():
     )
     
     # Log the feedback submission
-    audit_logger.log_data_event(
-        user_id=user_id,
-        resource_id=feedback_id,
-        resource_type="feedback",
-        action="submit",
-        status="success",
-        ip_address=request.remote_addr,
-        session_id=request.cookies.get('session')
-    )
+    if audit_logger.should_sample("submit"):
+        audit_logger.enqueue_data_event(
+            user_id=user_id,
+            resource_id=feedback_id,
+            resource_type="feedback",
+            action="submit",
+            status="success",
+            ip_address=g.remote_addr,
+            session_id=g.session_id
+        )
     
     return jsonify({
         "success": True,
@@ -1870,27 +2482,40 @@ def submit_user_feedback():
 # --- DATASET DOCUMENT MANAGEMENT ENDPOINTS ---
 from flask import send_from_directory
 
+# Per-dataset document listings: dataset_name -> (cached_at, doc_list).
+# Entries expire after DATASET_DOCS_TTL seconds and are dropped on every write to the dataset.
+_dataset_docs_cache = {}
+DATASET_DOCS_TTL = 30
+
 @app.route('/api/datasets/<dataset_name>/documents', methods=['GET'])
 def list_dataset_documents(dataset_name):
-    """List all documents in a dataset (by Chroma collection metadata)."""
+    """List all documents in a dataset (by Chroma collection metadata).
+
+    Chunk ids per document are only included with ?include_ids=true.
+    """
+    include_ids = request.args.get('include_ids', 'false').lower() == 'true'
+    cached = _dataset_docs_cache.get(dataset_name)
+    if not include_ids and cached and time.time() - cached[0] < DATASET_DOCS_TTL:
+        return jsonify(cached[1])
     try:
-        collection = chroma_client.get_collection(name=dataset_name)
+        collection = _get_collection(dataset_name)
         results = collection.get(include=["metadatas"])  # Only metadatas, ids always returned
-        print(f"[DEBUG] Chroma collection metadatas for {dataset_name}:")
-        for meta, doc_id in zip(results["metadatas"], results["ids"]):
-            print(f"  id={doc_id} meta={meta}")
-        docs = {}
-        for meta, doc_id in zip(results["metadatas"], results["ids"]):
-            filename = meta.get("source") or meta.get("file") or meta.get("filename")
-            if not filename:
-                continue
-            if filename not in docs:
-                docs[filename] = {"filename": filename, "ids": [], "id": filename}
-            docs[filename]["ids"].append(doc_id)
-        doc_list = list(docs.values())
+        if include_ids:
+            ids_by_source = defaultdict(list)
+            for meta, doc_id in zip(results["metadatas"], results["ids"]):
+                filename = meta.get("source") or meta.get("file") or meta.get("filename")
+                if filename:
+                    ids_by_source[filename].append(doc_id)
+            doc_list = [{"filename": s, "id": s, "ids": ids} for s, ids in sorted(ids_by_source.items())]
+        else:
+            sources = {m.get("source") or m.get("file") or m.get("filename") for m in results["metadatas"]}
+            sources -= {None, ""}
+            doc_list = [{"filename": s, "id": s} for s in sorted(sources)]
         if not doc_list:
             # Return all metadatas for debugging
             return jsonify({"documents": [], "debug_metadatas": results["metadatas"]}), 200
+        if not include_ids:
+            _dataset_docs_cache[dataset_name] = (time.time(), doc_list)
         return jsonify(doc_list)
     except Exception as e:
         print(f"Error listing documents for dataset {dataset_name}: {e}")
@@ -1902,7 +2527,7 @@ def upload_documents_to_dataset(dataset_name):
     def generate_progress():
         try:
             if 'files' not in request.files:
-                yield json.dumps({"status": "error", "message": "No files uploaded"}) + "\n"
+                yield _json_bytes({"status": "error", "message": "No files uploaded"}) + b"\n"
                 return
 
             # Save uploaded files
@@ -1913,27 +2538,23 @@ def upload_documents_to_dataset(dataset_name):
             saved_files = []
             
             # Initial progress update
-            yield json.dumps({"progress": 0.0, "status": "Starting upload..."}) + "\n"
-            time.sleep(0.5)  # Simulate processing delay
+            yield _json_bytes({"progress": 0.0, "status": "Starting upload..."}) + b"\n"
             
             for file in uploaded_files:
                 if file and allowed_file(file.filename):
                     filename = secure_filename(file.filename)
                     file_path = os.path.join(upload_path, filename)
-                    file.save(file_path)
+                    _save_upload(file, file_path)
                     saved_files.append(filename)
             
             if not saved_files:
-                yield json.dumps({"status": "error", "message": "No valid files uploaded"}) + "\n"
+                yield _json_bytes({"status": "error", "message": "No valid files uploaded"}) + b"\n"
                 return
 
             # Get collection
-            collection = chroma_client.get_or_create_collection(name=dataset_name)
+            collection = _get_collection(dataset_name, create=True)
             
             # Process and add to Chroma
-            documents = []
-            metadatas = []
-            ids = []
             total_documents = len(saved_files)  # This is the number of actual files uploaded
             
             # Get existing metadata
@@ -1942,84 +2563,108 @@ def upload_documents_to_dataset(dataset_name):
             existing_doc_count = current_metadata.get("document_count", 0)
             
             # Update progress for file processing
-            yield json.dumps({"progress": 0.2, "status": "Processing files..."}) + "\n"
-            time.sleep(0.5)  # Simulate processing delay
+            yield _json_bytes({"progress": 0.2, "status": "Processing files..."}) + b"\n"
             
             # Keep track of unique documents
             unique_documents = set()
             
-            for i, doc_file in enumerate(saved_files):
-                file_path = os.path.join(upload_path, doc_file)
-                try:
-                    if doc_file.endswith('.pdf'):
-                        extracted_texts = robust_extract_text_from_pdf(file_path)
-                        for j, text in enumerate(extracted_texts):
-                            if text and len(text) > 50:
-                                documents.append(text)
-                                metadatas.append({"source": doc_file, "page": j + 1})
-                                ids.append(f"{doc_file}_{i}_{j}")
-                                unique_documents.add(doc_file)  # Add to unique documents set
-                    elif doc_file.endswith('.txt'):
-                        with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                            text = f.read()
-                        chunks = [t.strip() for t in text.split('\n\n') if t.strip()]
-                        for j, chunk in enumerate(chunks):
-                            if len(chunk) > 50:
-                                documents.append(chunk)
-                                metadatas.append({"source": doc_file, "page": 1})
-                                ids.append(f"{doc_file}_{i}_{j}")
-                                unique_documents.add(doc_file)  # Add to unique documents set
-                except Exception as e:
-                    print(f"Error processing {file_path}: {str(e)}")
-                
-                # Update progress during file processing
-                progress = 0.2 + (0.4 * (i + 1) / total_documents)
-                yield json.dumps({"progress": progress, "status": f"Processing file {i+1} of {total_documents}..."}) + "\n"
-                time.sleep(0.5)  # Simulate processing delay
+            # Extraction and Chroma adds form a pipeline: filled batches are queued for an
+            # add worker, so embedding one batch overlaps with extracting the next file
+            add_queue = queue.Queue(maxsize=2)
+            add_errors = []
+            added = 0
             
-            # Update progress for Chroma processing
-            yield json.dumps({"progress": 0.6, "status": "Adding to database..."}) + "\n"
-            time.sleep(0.5)  # Simulate processing delay
+            def add_worker():
+                nonlocal added
+                while True:
+                    batch = add_queue.get()
+                    if batch is None:
+                        return
+                    if add_errors:
+                        continue  # Keep draining so the producer never blocks on a full queue
+                    try:
+                        collection.add(documents=batch["docs"], metadatas=batch["meta"], ids=batch["ids"])
+                        added += len(batch["docs"])
+                    except Exception as e:
+                        add_errors.append(e)
             
-            # Add to Chroma in batches
-            total_batches = (len(documents) + 99) // 100
-            for i in range(0, len(documents), 100):
-                batch_docs = documents[i:i+100]
-                batch_meta = metadatas[i:i+100]
-                batch_ids = ids[i:i+100]
-                collection.add(documents=batch_docs, metadatas=batch_meta, ids=batch_ids)
-                
-                # Update progress during batch processing
-                batch_progress = 0.6 + (0.3 * (i // 100 + 1) / total_batches)
-                yield json.dumps({"progress": batch_progress, "status": f"Processing batch {i//100 + 1} of {total_batches}..."}) + "\n"
-                time.sleep(0.5)  # Simulate processing delay
+            # Chunks are queued whenever the buffer fills, so memory is bounded by a few
+            # batches rather than every chunk of every uploaded file
+            pending = {"docs": [], "meta": [], "ids": [], "chars": 0}
+            
+            def flush_pending():
+                if pending["docs"]:
+                    add_queue.put(dict(pending))
+                    pending.update(docs=[], meta=[], ids=[], chars=0)
+            
+            def add_chunk(text, meta, chunk_id):
+                pending["docs"].append(text)
+                pending["meta"].append(meta)
+                pending["ids"].append(chunk_id)
+                pending["chars"] += len(text)
+                if len(pending["docs"]) >= ADD_BATCH_SIZE or pending["chars"] >= ADD_BATCH_MAX_CHARS:
+                    flush_pending()
+            
+            # Only report progress when the whole percentage changes
+            last_pct = 20
+            
+            # PDF extraction is CPU-bound, so PDFs are spread across processes while text
+            # files are chunked inline; a single thread runs the add worker throughout
+            pdf_files = [(i, doc_file) for i, doc_file in enumerate(saved_files) if doc_file.endswith('.pdf')]
+            txt_files = [(i, doc_file) for i, doc_file in enumerate(saved_files) if doc_file.endswith('.txt')]
+            executor = get_extraction_pool()
+            with ThreadPoolExecutor(max_workers=1) as add_executor:
+                adder = add_executor.submit(add_worker)
+                try:
+                    futures = {
+                        executor.submit(dataset_pdf_chunks, os.path.join(upload_path, doc_file), doc_file, i): doc_file
+                        for i, doc_file in pdf_files
+                    }
+                    # Text files are fast to chunk, so handle them while the PDFs extract
+                    text_results = (
+                        (doc_file, partial(_dataset_text_chunks, os.path.join(upload_path, doc_file), doc_file, i))
+                        for i, doc_file in txt_files
+                    )
+                    pdf_results = ((futures[future], future.result) for future in as_completed(futures))
+                    for done, (doc_file, get_chunks) in enumerate(itertools.chain(text_results, pdf_results), 1):
+                        try:
+                            for text, meta, chunk_id in get_chunks():
+                                add_chunk(text, meta, chunk_id)
+                                unique_documents.add(doc_file)  # Add to unique documents set
+                        except Exception as e:
+                            print(f"Error processing {os.path.join(upload_path, doc_file)}: {str(e)}")
+                        
+                        # Progress tracks files processed; their chunks are stored or queued
+                        progress = 0.2 + (0.7 * done / total_documents)
+                        if int(progress * 100) != last_pct:
+                            last_pct = int(progress * 100)
+                            yield _json_bytes({
+                                "progress": progress,
+                                "status": f"Processing file {done} of {total_documents} ({added} chunks added)..."
+                            }) + b"\n"
+                    
+                    # Queue the remaining partial batch
+                    flush_pending()
+                finally:
+                    add_queue.put(None)
+            adder.result()
+            if add_errors:
+                raise add_errors[0]
+            yield _json_bytes({"progress": 0.9, "status": f"Added {added} chunks to database"}) + b"\n"
             
             # Update dataset metadata with the correct document count
             if dataset_name in dataset_metadata:
-                # Get current unique documents from collection
-                results = collection.get(include=["metadatas"])
-                current_unique_sources = set()
-                for meta in results["metadatas"]:
-                    source = meta.get("source")
-                    if source:
-                        current_unique_sources.add(source)
-                
-                # Add new unique documents
-                for doc_file in saved_files:
-                    current_unique_sources.add(doc_file)
-                
-                # Update metadata with total unique documents
-                current_metadata["document_count"] = len(current_unique_sources)
-                current_metadata["last_update_date"] = datetime.now().isoformat()
-                dataset_metadata[dataset_name] = current_metadata
-                save_dataset_metadata(dataset_metadata)
+                # Extend the tracked sources with this upload instead of rescanning the collection
+                current_unique_sources = _known_sources(current_metadata, collection) | set(saved_files)
+                _store_sources(dataset_name, current_metadata, current_unique_sources)
+            _dataset_docs_cache.pop(dataset_name, None)
             
             # Final progress update with success message
-            yield json.dumps({"progress": 1.0, "status": "Upload complete!", "success": True}) + "\n"
+            yield _json_bytes({"progress": 1.0, "status": "Upload complete!", "success": True}) + b"\n"
             
         except Exception as e:
             print(f"Error uploading documents to dataset {dataset_name}: {e}")
-            yield json.dumps({"status": "error", "message": f"Server error: {str(e)}"}) + "\n"
+            yield _json_bytes({"status": "error", "message": f"Server error: {str(e)}"}) + b"\n"
     
     return Response(stream_with_context(generate_progress()), mimetype='application/x-ndjson')
 
@@ -2027,33 +2672,23 @@ def upload_documents_to_dataset(dataset_name):
 def delete_document_from_dataset(dataset_name, doc_id):
     """Delete a document and all its chunks from a dataset."""
     try:
-        collection = chroma_client.get_collection(name=dataset_name)
-        # Find all ids for this document (by filename)
-        results = collection.get(include=["metadatas"])  # Only metadatas, ids always returned
-        ids_to_delete = [id_ for meta, id_ in zip(results["metadatas"], results["ids"]) if meta.get("source") == doc_id or meta.get("file") == doc_id or meta.get("filename") == doc_id]
+        collection = _get_collection(dataset_name)
+        # Find all ids for this document (by filename); Chroma applies the filter itself
+        where = {"$or": [{"source": doc_id}, {"file": doc_id}, {"filename": doc_id}]}
+        ids_to_delete = collection.get(where=where, include=[])["ids"]
         if not ids_to_delete:
             return jsonify({"success": False, "message": "No chunks found for this document."}), 404
         
         # Delete the chunks
         collection.delete(ids=ids_to_delete)
+        _dataset_docs_cache.pop(dataset_name, None)
         
         # Update dataset metadata with new document count
         dataset_metadata = load_dataset_metadata()
         if dataset_name in dataset_metadata:
-            # Get current unique documents from collection after deletion
-            results = collection.get(include=["metadatas"])
-            current_unique_sources = set()
-            for meta in results["metadatas"]:
-                source = meta.get("source")
-                if source:
-                    current_unique_sources.add(source)
-            
-            # Update metadata with new document count
             current_metadata = dataset_metadata[dataset_name]
-            current_metadata["document_count"] = len(current_unique_sources)
-            current_metadata["last_update_date"] = datetime.now().isoformat()
-            dataset_metadata[dataset_name] = current_metadata
-            save_dataset_metadata(dataset_metadata)
+            current_unique_sources = _known_sources(current_metadata, collection) - {doc_id}
+            _store_sources(dataset_name, current_metadata, current_unique_sources)
         
         return jsonify({"success": True, "message": f"Deleted document {doc_id} and its chunks."})
     except Exception as e:
@@ -2079,26 +2714,123 @@ def update_dataset_metadata_route_alias(dataset_name):
     return update_dataset_metadata_route(dataset_name)
 
 # Add these functions before the add_message route
-def update_streaming_message(chat_id: str, content: str) -> None:
-    """Update a streaming message in the chat storage."""
+def _write_chat_file(chat_id: str, chat: dict) -> None:
+    """Atomically replace a chat's JSON file in the chat storage directory.
+
+    The file stays JSON because ChatStorage reads it back; writing to a temp
+    file and renaming means a reader never sees a half-written chat.
+    """
+    chat_file = os.path.join(chat_storage.storage_dir, f"{chat_id}.json")
+    fd, tmp_path = tempfile.mkstemp(dir=chat_storage.storage_dir, suffix='.tmp')
     try:
-        chat = chat_storage.get_chat(chat_id)
-        if chat and chat.get('messages'):
-            # Find the last message (which should be the streaming one)
-            last_message = chat['messages'][-1]
-            if last_message['role'] == 'assistant':
-                last_message['content'] = content
-                last_message['metadata'] = last_message.get('metadata', {})
-                last_message['metadata']['streaming'] = True
-                # Save the updated chat
-                chat_file = os.path.join(chat_storage.storage_dir, f"{chat_id}.json")
-                with open(chat_file, 'w') as f:
-                    json.dump(chat, f, indent=2)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(_json_bytes(chat, indent=app.debug))
+        os.replace(tmp_path, chat_file)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+
+# Characters of each in-progress response already appended to its stream log
+_stream_log_lengths = {}
+
+def _stream_log_path(chat_id: str) -> str:
+    """Path of the append-only log holding a chat's in-progress response."""
+    return os.path.join(chat_storage.storage_dir, f"{chat_id}.json.stream")
+
+def _read_stream_log(chat_id: str):
+    """Return the response text logged so far for a streaming chat, or None if there is none.
+
+    Each line of the log is one JSON-encoded delta, so deltas may contain newlines.
+    """
+    try:
+        with open(_stream_log_path(chat_id), 'rb') as f:
+            return "".join(_json_loads(line) for line in f if line.strip())
+    except FileNotFoundError:
+        return None
+
+def _merge_stream_log(chat_id: str, chat: dict) -> None:
+    """Put the logged text of a still-streaming response into the chat's last message.
+
+    The chat file keeps the placeholder until finalize_message, so readers that
+    want the response so far merge the stream log in here.
+    """
+    messages = chat.get('messages')
+    if messages and messages[-1].get('metadata', {}).get('streaming'):
+        streamed = _read_stream_log(chat_id)
+        if streamed:
+            messages[-1]['content'] = streamed
+
+def _discard_stream_log(chat_id: str) -> None:
+    """Forget a chat's streaming state and remove its stream log, if any."""
+    _stream_log_lengths.pop(chat_id, None)
+    try:
+        os.remove(_stream_log_path(chat_id))
+    except FileNotFoundError:
+        pass
+
+def _append_stream_log(chat_id: str, content: str) -> None:
+    """Append the new part of a streaming message to the chat's stream log.
+
+    The chat file itself is only rewritten by finalize_message, so each append
+    writes just the characters added since the previous one.
+    """
+    try:
+        logged = _stream_log_lengths.get(chat_id)
+        # First update of this response (or content was replaced): start a fresh log
+        mode = 'ab'
+        if logged is None or len(content) < logged:
+            logged, mode = 0, 'wb'
+        with open(_stream_log_path(chat_id), mode) as f:
+            f.write(_json_bytes(content[logged:]) + b"\n")
+        _stream_log_lengths[chat_id] = len(content)
     except Exception as e:
         print(f"Error updating streaming message: {str(e)}")
 
+# Streaming updates from every chat go through one writer thread
+STREAM_FLUSH_INTERVAL = 0.05  # Seconds to collect updates before writing
+STREAM_FLUSH_MAX_UPDATES = 256
+# Items are (chat_id, content, None) updates or (chat_id, None, Event) flush markers
+_stream_queue = queue.Queue()
+
+def _stream_writer() -> None:
+    """Collect queued streaming updates, keep the latest per chat, and write each once.
+
+    Flush markers are signalled once the updates queued before them are written.
+    """
+    while True:
+        batch = [_stream_queue.get()]
+        deadline = time.monotonic() + STREAM_FLUSH_INTERVAL
+        while len(batch) < STREAM_FLUSH_MAX_UPDATES:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(_stream_queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        try:
+            # Later updates carry the full response so far, so they supersede earlier ones
+            latest = {chat_id: content for chat_id, content, _ in batch if content is not None}
+            for chat_id, content in latest.items():
+                _append_stream_log(chat_id, content)
+        finally:
+            for _, _, flushed in batch:
+                if flushed is not None:
+                    flushed.set()
+
+threading.Thread(target=_stream_writer, name="chat-stream-writer", daemon=True).start()
+
+def update_streaming_message(chat_id: str, content: str) -> None:
+    """Queue the latest content of a streaming message for the writer thread."""
+    _stream_queue.put_nowait((chat_id, content, None))
+
 def finalize_message(chat_id: str, content: str) -> None:
     """Finalize a streaming message in the chat storage."""
+    # Let this chat's queued updates land first so none recreates the stream log after it
+    # is removed; other chats' streams are not waited for
+    flushed = threading.Event()
+    _stream_queue.put_nowait((chat_id, None, flushed))
+    flushed.wait()
     try:
         chat = chat_storage.get_chat(chat_id)
         if chat and chat.get('messages'):
@@ -2109,11 +2841,11 @@ def finalize_message(chat_id: str, content: str) -> None:
                 last_message['metadata'] = last_message.get('metadata', {})
                 last_message['metadata']['streaming'] = False
                 # Save the updated chat
-                chat_file = os.path.join(chat_storage.storage_dir, f"{chat_id}.json")
-                with open(chat_file, 'w') as f:
-                    json.dump(chat, f, indent=2)
+                _write_chat_file(chat_id, chat)
     except Exception as e:
         print(f"Error finalizing message: {str(e)}")
+    finally:
+        _discard_stream_log(chat_id)
 
 if __name__ == '__main__':
     app.run(debug=True, port=5000)
\ No newline at end of file
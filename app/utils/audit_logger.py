@@ -6,8 +6,13 @@ import os
 import json
 import time
 import uuid
+import queue
+import random
+import atexit
 import socket
 import logging
+import logging.handlers
+import threading
 import traceback
 from typing import Dict, Any, Optional, List, Union
 from pathlib import Path
@@ -16,12 +21,18 @@ from datetime import datetime
 class AuditLogger:
     """Audit logging for security and compliance tracking."""
     
-    def __init__(self, log_dir: Optional[str] = None, enabled: bool = True):
+    def __init__(
+        self,
+        log_dir: Optional[str] = None,
+        enabled: bool = True,
+        sample_rates: Optional[Dict[str, float]] = None
+    ):
         """Initialize the audit logger.
         
         Args:
             log_dir: Directory for storing audit logs
             enabled: Whether audit logging is enabled
+            sample_rates: Fraction of events to log per action (see should_sample)
         """
         # Set up log directory
         if log_dir is None:
@@ -30,6 +41,7 @@ class AuditLogger:
         
         self.log_dir = log_dir
         self.enabled = enabled
+        self.sample_rates = sample_rates or {}
         self.hostname = socket.gethostname()
         
         # Create log directory if it doesn't exist
@@ -44,6 +56,24 @@ class AuditLogger:
         self.logger.addHandler(handler)
         self.logger.setLevel(logging.INFO)
     
+    def should_sample(self, action: str, default_rate: float = 1.0) -> bool:
+        """Decide whether to log an event for an action.
+        
+        Lets callers skip building an event at all when logging is disabled
+        or the action is sampled out.
+        
+        Args:
+            action: Action being performed
+            default_rate: Fraction of events to log if no rate is configured for the action
+            
+        Returns:
+            Whether the event should be logged
+        """
+        if not self.enabled:
+            return False
+        rate = self.sample_rates.get(action, default_rate)
+        return rate >= 1.0 or random.random() < rate
+    
     def log_event(
         self,
         event_type: str,
@@ -75,12 +105,59 @@ class AuditLogger:
         if not self.enabled:
             return ""
         
-        event_id = str(uuid.uuid4())
-        timestamp = time.time()
+        event_data = self._build_event(
+            time.time(),
+            event_type=event_type,
+            user_id=user_id,
+            resource_id=resource_id,
+            resource_type=resource_type,
+            action=action,
+            status=status,
+            details=details,
+            ip_address=ip_address,
+            session_id=session_id
+        )
+        
+        # Log to structured log file
+        self._write_log_entry(event_data)
+        
+        # Also log a simple message to the logger
+        self._log_message(event_data)
         
-        # Create event data
-        event_data = {
-            "id": event_id,
+        return event_data["id"]
+    
+    def _build_event(
+        self,
+        timestamp: float,
+        event_type: str,
+        user_id: Optional[str] = None,
+        resource_id: Optional[str] = None,
+        resource_type: Optional[str] = None,
+        action: Optional[str] = None,
+        status: str = "success",
+        details: Optional[Dict[str, Any]] = None,
+        ip_address: Optional[str] = None,
+        session_id: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """Create the event data for an audit event.
+        
+        Args:
+            timestamp: Time the event happened, in seconds since the epoch
+            event_type: Type of event (e.g., authentication, access, data)
+            user_id: ID of the user performing the action
+            resource_id: ID of the resource being accessed
+            resource_type: Type of resource being accessed
+            action: Action being performed
+            status: Status of the action (success, failure, error)
+            details: Additional details about the event
+            ip_address: IP address of the user
+            session_id: Session ID of the user
+            
+        Returns:
+            Event data
+        """
+        return {
+            "id": str(uuid.uuid4()),
             "timestamp": timestamp,
             "datetime": datetime.fromtimestamp(timestamp).isoformat(),
             "event_type": event_type,
@@ -94,20 +171,22 @@ class AuditLogger:
             "session_id": session_id,
             "hostname": self.hostname
         }
+    
+    def _log_message(self, event_data: Dict[str, Any]) -> None:
+        """Write the one-line summary of an event to the text log.
         
-        # Log to structured log file
-        self._write_log_entry(event_data)
-        
-        # Also log a simple message to the logger
-        message = f"{event_type}.{action} - User: {user_id} - Resource: {resource_id} - Status: {status}"
+        Args:
+            event_data: Event data
+        """
+        status = event_data["status"]
+        message = (f"{event_data['event_type']}.{event_data['action']} - User: {event_data['user_id']} "
+                   f"- Resource: {event_data['resource_id']} - Status: {status}")
         if status == "success":
             self.logger.info(message)
         elif status == "failure":
             self.logger.warning(message)
         else:
             self.logger.error(message)
-        
-        return event_id
     
     def log_authentication(
         self,
@@ -483,4 +562,147 @@ class AuditLogger:
                     except Exception:
                         pass
         
-        return deleted_count
\ No newline at end of file
+        return deleted_count
+
+
+class AsyncAuditLogger(AuditLogger):
+    """Audit logger that writes entries from a background thread.
+    
+    Events are queued on the request path and a daemon thread appends them in
+    batches, one write and fsync per log file every flush_interval seconds or
+    max_batch events. The queue is bounded, so a stalled disk slows callers
+    down instead of growing memory. Pending events are flushed before reads
+    and at interpreter exit.
+    """
+    
+    def __init__(
+        self,
+        log_dir: Optional[str] = None,
+        enabled: bool = True,
+        sample_rates: Optional[Dict[str, float]] = None,
+        flush_interval: float = 0.1,
+        max_queue: int = 10000,
+        max_batch: int = 256
+    ):
+        """Initialize the asynchronous audit logger.
+        
+        Args:
+            log_dir: Directory for storing audit logs
+            enabled: Whether audit logging is enabled
+            sample_rates: Fraction of events to log per action (see should_sample)
+            flush_interval: Seconds to collect events before writing a batch
+            max_queue: Maximum number of events waiting to be written
+            max_batch: Maximum number of events written in one batch
+        """
+        super().__init__(log_dir=log_dir, enabled=enabled, sample_rates=sample_rates)
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._closed = False
+        
+        if not self.enabled:
+            return
+        
+        # Hand the text log's file handlers to a listener thread as well
+        handlers = list(self.logger.handlers)
+        for handler in handlers:
+            self.logger.removeHandler(handler)
+        self._listener = logging.handlers.QueueListener(queue.SimpleQueue(), *handlers)
+        self.logger.addHandler(logging.handlers.QueueHandler(self._listener.queue))
+        self._listener.start()
+        
+        self._writer = threading.Thread(target=self._run, name="audit-log-writer", daemon=True)
+        self._writer.start()
+        atexit.register(self.close)
+    
+    def _write_log_entry(self, event_data: Dict[str, Any]) -> None:
+        """Queue an event to be written by the background thread.
+        
+        Args:
+            event_data: Event data to write
+        """
+        self._queue.put(event_data)
+    
+    def enqueue_data_event(self, **kwargs) -> None:
+        """Queue a data event without building it on the caller's thread.
+        
+        Takes the same arguments as log_data_event. The event ID is not
+        returned; the event is created and logged by the background thread.
+        """
+        if self.enabled:
+            self._queue.put((time.time(), kwargs))
+    
+    def _run(self) -> None:
+        """Collect queued events for up to flush_interval seconds, then write them."""
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                self._write_batch([self._resolve_entry(entry) for entry in batch])
+            except Exception as e:
+                print(f"Error writing audit log batch: {str(e)}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+    
+    def _resolve_entry(self, entry: Union[Dict[str, Any], tuple]) -> Dict[str, Any]:
+        """Turn a queued entry into event data, building deferred data events.
+        
+        Args:
+            entry: Event data, or a (timestamp, kwargs) pair from enqueue_data_event
+            
+        Returns:
+            Event data
+        """
+        if isinstance(entry, dict):
+            return entry
+        timestamp, kwargs = entry
+        event_data = self._build_event(timestamp, event_type="data", **kwargs)
+        self._log_message(event_data)
+        return event_data
+    
+    def _write_batch(self, batch: List[Dict[str, Any]]) -> None:
+        """Append a batch of events, grouped by daily log file.
+        
+        Args:
+            batch: Event data to write
+        """
+        lines_by_file: Dict[str, List[str]] = {}
+        for event_data in batch:
+            date = datetime.fromtimestamp(event_data["timestamp"]).strftime("%Y%m%d")
+            log_file = os.path.join(self.log_dir, f"{date}.jsonl")
+            lines_by_file.setdefault(log_file, []).append(json.dumps(event_data) + "\n")
+        
+        for log_file, lines in lines_by_file.items():
+            with open(log_file, 'a') as f:
+                f.write("".join(lines))
+                f.flush()
+                os.fsync(f.fileno())
+    
+    def flush(self) -> None:
+        """Block until every queued event has been written."""
+        if self.enabled:
+            self._queue.join()
+    
+    def close(self) -> None:
+        """Flush pending events and stop the text log listener."""
+        if self.enabled and not self._closed:
+            self.flush()
+            self._listener.stop()
+            self._closed = True
+    
+    def get_events(self, *args, **kwargs) -> List[Dict[str, Any]]:
+        """Get audit events, including ones still queued for writing.
+        
+        Accepts the same arguments as AuditLogger.get_events.
+        """
+        self.flush()
+        return super().get_events(*args, **kwargs)
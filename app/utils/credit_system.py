@@ -6,9 +6,16 @@ import os
 import json
 import time
 import uuid
+import threading
+from contextlib import contextmanager
 from typing import Dict, Any, Optional, List, Tuple
 from pathlib import Path
 from datetime import datetime
+try:
+    import fcntl  # POSIX only
+    FCNTL_AVAILABLE = True
+except ImportError:
+    FCNTL_AVAILABLE = False
 
 class CreditSystem:
     """Credit system for tracking and managing user usage."""
@@ -30,6 +37,24 @@ class CreditSystem:
         # Initialize transaction directory
         self.transaction_dir = os.path.join(self.storage_dir, "transactions")
         os.makedirs(self.transaction_dir, exist_ok=True)
+        
+        # Serializes balance read-modify-writes between threads; the file lock in
+        # _balance_lock extends this to the other server processes
+        self._lock = threading.Lock()
+    
+    @contextmanager
+    def _balance_lock(self, user_id: str):
+        """Hold an exclusive lock on a user's balance across threads and processes."""
+        with self._lock:
+            if not FCNTL_AVAILABLE:
+                yield
+                return
+            with open(os.path.join(self.storage_dir, f"{user_id}.lock"), 'w') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
     
     def get_user_balance(self, user_id: str) -> int:
         """Get a user's current credit balance.
@@ -73,24 +98,25 @@ class CreditSystem:
         Returns:
             Tuple of (success, new balance)
         """
-        # Get current balance
-        current_balance = self.get_user_balance(user_id)
-        
-        # Check if deduction would result in negative balance
-        if amount < 0 and current_balance + amount < 0:
-            return False, current_balance
-        
-        # Calculate new balance
-        new_balance = current_balance + amount
-        
-        # Update balance file
-        balance_file = os.path.join(self.storage_dir, f"{user_id}.json")
-        with open(balance_file, 'w') as f:
-            json.dump({
-                "user_id": user_id,
-                "balance": new_balance,
-                "updated_at": time.time()
-            }, f)
+        with self._balance_lock(user_id):
+            # Get current balance
+            current_balance = self.get_user_balance(user_id)
+            
+            # Check if deduction would result in negative balance
+            if amount < 0 and current_balance + amount < 0:
+                return False, current_balance
+            
+            # Calculate new balance
+            new_balance = current_balance + amount
+            
+            # Update balance file
+            balance_file = os.path.join(self.storage_dir, f"{user_id}.json")
+            with open(balance_file, 'w') as f:
+                json.dump({
+                    "user_id": user_id,
+                    "balance": new_balance,
+                    "updated_at": time.time()
+                }, f)
         
         # Record transaction
         self._record_transaction(
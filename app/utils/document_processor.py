@@ -3,15 +3,215 @@ Utilities for processing legal documents and creating embeddings.
 """
 
 import os
+import hashlib
 from typing import List, Dict, Any, Tuple
 import uuid
+import sqlite3
+import queue
+import threading
+import time
+from array import array
+from concurrent.futures import Future
+from contextlib import closing
+from functools import lru_cache
+from pathlib import Path
 from langchain_community.embeddings import HuggingFaceEmbeddings
 from unstructured.partition.pdf import partition_pdf
 from unstructured.cleaners.core import clean_extra_whitespace
 import chromadb
-import torch
+from chromadb.db.base import UniqueConstraintError
 from tqdm import tqdm
-from app.main import HNSW_CONFIG  # Import the HNSW configuration
+from app.main import HNSW_METADATA  # Import the HNSW configuration
+
+# Collections are created without an explicit embedding function, so Chroma embeds
+# documents (and must embed queries) with its default all-MiniLM-L6-v2 model
+QUERY_EMBEDDING_MODEL = "chroma-default/all-MiniLM-L6-v2"
+QUERY_EMBEDDING_CACHE_PATH = os.path.join(
+    Path(__file__).resolve().parent.parent.parent, "data", "cache", "query_embeddings.sqlite3"
+)
+
+_query_embedding_function = None
+
+def get_or_create_hnsw_collection(client, name: str):
+    """Return a collection, creating it with HNSW_METADATA only if it does not exist.
+
+    get_or_create_collection(metadata=...) rewrites an existing collection's
+    metadata whenever it differs, which would misdescribe how its index was built.
+    """
+    try:
+        return client.get_collection(name=name)
+    except ValueError:
+        pass
+    try:
+        return client.create_collection(name=name, metadata=HNSW_METADATA)
+    except UniqueConstraintError:
+        # Created by another worker since the lookup above
+        return client.get_collection(name=name)
+
+def _get_query_embedding_function():
+    """Lazily create the embedding function used by the Chroma collections."""
+    global _query_embedding_function
+    if _query_embedding_function is None:
+        from chromadb.utils import embedding_functions
+        _query_embedding_function = embedding_functions.DefaultEmbeddingFunction()
+    return _query_embedding_function
+
+def warm_query_embedding_model() -> None:
+    """Download and load the query embedding model ahead of the first user query."""
+    _get_query_embedding_function()(["warmup"])
+
+class EmbeddingBatcher:
+    """Coalesce concurrent embedding requests into a single model call.
+    
+    Requests are queued and a background thread flushes them together once
+    max_batch_size texts are waiting or max_wait seconds have passed since the
+    first one arrived.
+    """
+    
+    def __init__(self, embed_fn, max_batch_size: int = 64, max_wait: float = 0.01):
+        """Initialize the batcher.
+        
+        Args:
+            embed_fn: Function mapping a list of texts to a list of embeddings
+            max_batch_size: Maximum number of texts per model call
+            max_wait: Maximum time in seconds to wait for a batch to fill
+        """
+        self.embed_fn = embed_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+        self._thread.start()
+    
+    def embed(self, text: str) -> List[float]:
+        """Embed a single text, blocking until its batch has been processed."""
+        future = Future()
+        self._queue.put((text, future))
+        return future.result()
+    
+    def _run(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            
+            try:
+                vectors = self.embed_fn([text for text, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future), vector in zip(batch, vectors):
+                future.set_result(vector)
+
+_query_batcher = None
+_query_batcher_lock = threading.Lock()
+
+def _get_query_batcher() -> EmbeddingBatcher:
+    """Lazily create the batcher that embeds queries."""
+    global _query_batcher
+    with _query_batcher_lock:
+        if _query_batcher is None:
+            _query_batcher = EmbeddingBatcher(lambda texts: _get_query_embedding_function()(texts))
+    return _query_batcher
+
+# Rows are keyed by a hash of the query, never its text, and expire after a week;
+# the table is also capped so it cannot grow without bound
+QUERY_EMBEDDING_CACHE_TTL = 7 * 24 * 60 * 60
+QUERY_EMBEDDING_CACHE_MAX_ROWS = 50000
+QUERY_EMBEDDING_PRUNE_EVERY = 100  # Writes between prunes
+
+_cache_writes = 0
+_cache_writes_lock = threading.Lock()
+
+def _query_cache_key(text: str) -> str:
+    """Key a normalized query by the SHA-256 of the model name and its text."""
+    return hashlib.sha256(f"{QUERY_EMBEDDING_MODEL}:{text}".encode()).hexdigest()
+
+def _load_persisted_embedding(key: str):
+    """Look up a query embedding in the on-disk cache shared between processes."""
+    try:
+        with closing(sqlite3.connect(QUERY_EMBEDDING_CACHE_PATH, timeout=5)) as conn, conn:
+            row = conn.execute(
+                "SELECT vector FROM query_vectors WHERE key = ? AND created_at >= ?",
+                (key, time.time() - QUERY_EMBEDDING_CACHE_TTL)
+            ).fetchone()
+    except sqlite3.Error:
+        return None
+    if row is None:
+        return None
+    vector = array('f')
+    vector.frombytes(row[0])
+    return vector
+
+def _prune_persisted_embeddings(conn: sqlite3.Connection) -> None:
+    """Drop expired rows, then the oldest rows beyond QUERY_EMBEDDING_CACHE_MAX_ROWS."""
+    conn.execute("DELETE FROM query_vectors WHERE created_at < ?", (time.time() - QUERY_EMBEDDING_CACHE_TTL,))
+    conn.execute(
+        "DELETE FROM query_vectors WHERE key IN "
+        "(SELECT key FROM query_vectors ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+        (QUERY_EMBEDDING_CACHE_MAX_ROWS,)
+    )
+
+def _persist_embedding(key: str, vector: array) -> None:
+    """Store a query embedding in the on-disk cache, pruning it periodically."""
+    global _cache_writes
+    with _cache_writes_lock:
+        _cache_writes += 1
+        prune = _cache_writes % QUERY_EMBEDDING_PRUNE_EVERY == 1
+    try:
+        os.makedirs(os.path.dirname(QUERY_EMBEDDING_CACHE_PATH), exist_ok=True)
+        with closing(sqlite3.connect(QUERY_EMBEDDING_CACHE_PATH, timeout=5)) as conn, conn:
+            if prune:
+                # Also removes the old table whose keys held the query text itself
+                conn.execute("DROP TABLE IF EXISTS query_embeddings")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS query_vectors (key TEXT PRIMARY KEY, vector BLOB, created_at REAL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS query_vectors_created_at ON query_vectors (created_at)")
+            conn.execute(
+                "INSERT OR REPLACE INTO query_vectors VALUES (?, ?, ?)", (key, vector.tobytes(), time.time())
+            )
+            if prune:
+                _prune_persisted_embeddings(conn)
+    except sqlite3.Error as e:
+        print(f"Warning: Could not persist query embedding: {str(e)}")
+
+@lru_cache(maxsize=4096)
+def _embed_query(text: str) -> array:
+    """Embed a normalized query, checking the on-disk cache before running the model."""
+    key = _query_cache_key(text)
+    vector = _load_persisted_embedding(key)
+    if vector is None:
+        vector = array('f', _get_query_batcher().embed(text))
+        _persist_embedding(key, vector)
+    return vector
+
+def embed_query(query: str) -> List[float]:
+    """Return the embedding for a user query, cached by its normalized text.
+
+    The model is uncased, so lowercasing and collapsing whitespace does not
+    change the embedding but lets equivalent queries share a cache entry.
+    """
+    return _embed_query(" ".join(query.split()).lower()).tolist()
+
+def _truncate_results(results: Dict[str, Any], n_results: int) -> Dict[str, Any]:
+    """Keep only the first n_results of a single-query Chroma result.
+
+    hnswlib searches with ef = max(search_ef, k), so asking Chroma for k = ef_search
+    neighbours and truncating afterwards gives a per-query ef override.
+    """
+    for key, value in results.items():
+        if isinstance(value, list) and value and isinstance(value[0], list):
+            results[key] = [value[0][:n_results]]
+    return results
 
 class LegalDocumentProcessor:
     """Processor for legal documents with specialized handling for legal terminology."""
@@ -27,15 +227,40 @@ class LegalDocumentProcessor:
         Args:
             embedding_model: Name of the HuggingFace embedding model
             chroma_path: Path to the Chroma DB
-            device: Device to use for embeddings ('cuda' or 'cpu')
+            device: Device to use for embeddings ('cuda' or 'cpu'); detected on
+                first model load when omitted
         """
-        self.device = device or ("cuda" if torch.cuda.is_available() else "cpu")
-        self.embeddings = HuggingFaceEmbeddings(
-            model_name=embedding_model,
-            model_kwargs={"device": self.device}
-        )
+        self._device = device
+        self.embedding_model = embedding_model
+        self._embeddings = None
         self.chroma_client = chromadb.PersistentClient(path=chroma_path)
     
+    @property
+    def device(self) -> str:
+        """Device for the embedding and reranking models.
+        
+        Probing CUDA imports torch and initializes the driver, so it is deferred
+        until a model is actually loaded.
+        """
+        if self._device is None:
+            import torch
+            self._device = "cuda" if torch.cuda.is_available() else "cpu"
+        return self._device
+    
+    @property
+    def embeddings(self) -> HuggingFaceEmbeddings:
+        """HuggingFace embedding model, loaded on first access.
+        
+        Chroma embeds documents and queries with its own default model, so
+        processors that never touch this attribute never pay for the weights.
+        """
+        if self._embeddings is None:
+            self._embeddings = HuggingFaceEmbeddings(
+                model_name=self.embedding_model,
+                model_kwargs={"device": self.device}
+            )
+        return self._embeddings
+    
     def process_document(self, file_path: str, chunk_size: int = 2000, chunk_overlap: int = 400) -> List[str]:
         """Process a single document and return chunked text.
         
@@ -356,10 +581,7 @@ class LegalDocumentProcessor:
         import glob
         
         # Create or get collection
-        collection = self.chroma_client.get_or_create_collection(
-            name=ragmodel_name,
-            hnsw_config=HNSW_CONFIG
-        )
+        collection = get_or_create_hnsw_collection(self.chroma_client, ragmodel_name)
         
         # Get list of PDF files
         file_paths = glob.glob(os.path.join(documents_dir, file_filter))
@@ -503,7 +725,8 @@ class LegalDocumentProcessor:
         query: str, 
         n_results: int = 5,
         use_hybrid_search: bool = True,
-        use_reranking: bool = True
+        use_reranking: bool = True,
+        ef_search: int = None
     ) -> Dict[str, Any]:
         """Query a ragmodel with a natural language query.
         
@@ -513,6 +736,8 @@ class LegalDocumentProcessor:
             n_results: Number of results to return
             use_hybrid_search: Whether to use hybrid search (vector + BM25)
             use_reranking: Whether to rerank results for better relevance
+            ef_search: Optional HNSW search breadth for this query, used when it is
+                higher than the collection's hnsw:search_ef
             
         Returns:
             Dictionary with query results
@@ -522,13 +747,17 @@ class LegalDocumentProcessor:
         
         collection = self.chroma_client.get_collection(name=ragmodel_name)
         
+        # Embed the query once and reuse it for every search below
+        query_embedding = embed_query(query)
+        
         # 1. Hybrid Search: Combine vector search with keyword search
         if use_hybrid_search:
             # Vector search component
-            vector_results = collection.query(
-                query_texts=[query],
-                n_results=min(n_results * 2, 20)  # Get more results for hybrid reranking
-            )
+            vector_k = min(n_results * 2, 20)  # Get more results for hybrid reranking
+            vector_results = _truncate_results(collection.query(
+                query_embeddings=[query_embedding],
+                n_results=max(vector_k, ef_search or 0)
+            ), vector_k)
             
             # Keyword search component (using where filter with $contains operator)
             # Split query into keywords
@@ -550,7 +779,7 @@ class LegalDocumentProcessor:
                     try:
                         # Use metadata $contains filter as keyword search
                         keyword_results = collection.query(
-                            query_texts=[query],
+                            query_embeddings=[query_embedding],
                             where_document={"$contains": keyword},
                             n_results=min(n_results, 10)
                         )
@@ -604,24 +833,27 @@ class LegalDocumentProcessor:
                     print(f"Error in reranking: {str(e)}")
         else:
             # Standard vector search if hybrid search is disabled
-            results = collection.query(
-                query_texts=[query],
-                n_results=n_results
-            )
+            results = _truncate_results(collection.query(
+                query_embeddings=[query_embedding],
+                n_results=max(n_results, ef_search or 0)
+            ), n_results)
             
         return results
 
-    def query_dataset(self, dataset_name, query, n_results=5, use_hybrid_search=True, use_reranking=True, where=None):
-        """Query the Chroma collection for relevant documents and metadatas."""
-        collection = self.chroma_client.get_or_create_collection(name=dataset_name)
-        
+    def query_dataset(self, dataset_name, query, n_results=5, use_hybrid_search=True, use_reranking=True, where=None, ef_search=None):
+        """Query the Chroma collection for relevant documents and metadatas.
+
+        Pass a higher ef_search for recall-critical queries or when n_results
+        is raised above 5.
+        """
         # Use the advanced query_ragmodel function which has hybrid search and reranking
         results = self.query_ragmodel(
             ragmodel_name=dataset_name,
             query=query,
             n_results=n_results,
             use_hybrid_search=use_hybrid_search,
-            use_reranking=use_reranking
+            use_reranking=use_reranking,
+            ef_search=ef_search
         )
         
         return results
\ No newline at end of file
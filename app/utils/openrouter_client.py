@@ -110,10 +110,8 @@ class OpenRouterClient:
         if chat_history is None:
             chat_history = []
         
-        # The context is actually a system message in this case
-        system_message = context
-        
-        # Use the provided chat history directly, as it should already include the system message
+        # The caller owns the prompt: chat_history already starts with the system
+        # message carrying the retrieved context, so context is not added again
         messages = chat_history
         
         # For streaming, return the response object for processing by the caller
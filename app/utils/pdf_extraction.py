@@ -0,0 +1,287 @@
+"""
+PDF text extraction for the Legal Sanctions RAG application.
+
+Kept apart from app.main so extraction pool workers import only this module,
+not the Flask app with its clients and background threads.
+"""
+
+import os
+import io
+import json
+import hashlib
+import tempfile
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import wraps, partial
+import PyPDF2
+from PIL import Image
+from unstructured.partition.pdf import partition_pdf
+try:
+    import pytesseract
+    PYTESSERACT_AVAILABLE = True
+except ImportError:
+    PYTESSERACT_AVAILABLE = False
+try:
+    import fitz  # PyMuPDF
+    PYMUPDF_AVAILABLE = True
+except ImportError:
+    PYMUPDF_AVAILABLE = False
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def _json_bytes(obj):
+    """Serialize obj to UTF-8 JSON bytes, using orjson when it is installed."""
+    return orjson.dumps(obj) if ORJSON_AVAILABLE else json.dumps(obj).encode()
+
+def _json_loads(raw):
+    """Parse JSON from bytes, using orjson when it is installed."""
+    return orjson.loads(raw) if ORJSON_AVAILABLE else json.loads(raw)
+
+# One process pool per web worker, shared by every upload route and created on first use.
+# Its processes come from a forkserver rather than a fork of the multi-threaded web
+# process, so they cannot inherit a lock some background thread held at fork time.
+EXTRACTION_WORKERS = int(os.environ.get("EXTRACTION_WORKERS", os.cpu_count() or 1))
+_extraction_pool = None
+_extraction_pool_lock = threading.Lock()
+
+def get_extraction_pool():
+    """Return the shared extraction process pool, replacing it if a worker died."""
+    global _extraction_pool
+    with _extraction_pool_lock:
+        # A worker killed mid-task (e.g. out of memory) leaves the executor unusable
+        if _extraction_pool is None or getattr(_extraction_pool, '_broken', False):
+            method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            context = multiprocessing.get_context(method)
+            if method == "forkserver":
+                context.set_forkserver_preload([__name__])
+            _extraction_pool = ProcessPoolExecutor(max_workers=EXTRACTION_WORKERS, mp_context=context)
+        return _extraction_pool
+
+# Cache for extracted PDF text, keyed by content hash
+PDF_TEXT_CACHE_DIR = os.path.join(BASE_DIR, "data", "cache", "pdf_text")
+EXTRACTOR_VERSION = "4"  # Bump when the extraction pipeline changes to invalidate cached text
+
+# Minimum amount of text for an extraction method to count as successful
+MIN_TEXT_LEN = 100
+
+# Prefer PyMuPDF's native text extraction; set USE_PYMUPDF=False to fall back to PyPDF2
+USE_PYMUPDF = PYMUPDF_AVAILABLE and os.environ.get("USE_PYMUPDF", "True").lower() == "true"
+
+def hash_file(file_path, chunk_size=1024 * 1024):
+    """Compute the SHA-256 of a file by streaming it in 1 MiB chunks."""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(chunk_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def cache_pdf_text(func):
+    """Cache the text extracted from a PDF on disk, keyed by its content hash."""
+    @wraps(func)
+    def wrapper(pdf_path):
+        try:
+            key = f"{hash_file(pdf_path)}-v{EXTRACTOR_VERSION}"
+        except IOError as e:
+            print(f"Warning: Could not hash {pdf_path} for text cache: {str(e)}")
+            return func(pdf_path)
+
+        cache_file = os.path.join(PDF_TEXT_CACHE_DIR, f"{key}.json")
+        if os.path.exists(cache_file):
+            try:
+                with open(cache_file, 'rb') as f:
+                    print(f"Using cached text for {pdf_path}")
+                    return _json_loads(f.read())
+            except (IOError, json.JSONDecodeError):
+                pass
+
+        all_text = func(pdf_path)
+
+        # Only cache successful extractions so failures are retried next time
+        if all_text:
+            try:
+                os.makedirs(PDF_TEXT_CACHE_DIR, exist_ok=True)
+                fd, tmp_path = tempfile.mkstemp(dir=PDF_TEXT_CACHE_DIR, suffix='.tmp')
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(_json_bytes(all_text))
+                os.replace(tmp_path, cache_file)
+            except IOError as e:
+                print(f"Warning: Could not write text cache for {pdf_path}: {str(e)}")
+        return all_text
+    return wrapper
+
+# Documents with fewer pages are extracted in-process; a worker pool costs more than it saves
+PARALLEL_PAGE_THRESHOLD = 8
+
+def _extract_page(pdf_bytes, page_num):
+    """Extract the text of a single PDF page (runs in a worker process)."""
+    pdf_reader = PyPDF2.PdfReader(io.BytesIO(pdf_bytes))
+    return page_num, pdf_reader.pages[page_num].extract_text()
+
+# OCR settings: render pages at a capped DPI and shrink oversized scans before Tesseract
+OCR_DPI = 200
+OCR_DOWNSCALE_THRESHOLD = 3000  # Long edge (px) above which a page image is shrunk
+OCR_MAX_SIDE = 2200
+OCR_WORKERS = 4
+OCR_CONFIG = '--oem 1 --psm 6'
+
+def _ocr_page(indexed_path):
+    """OCR a single rendered page image from disk, then delete it.
+
+    Runs in a worker thread; Tesseract itself runs as a subprocess.
+    """
+    page_num, image_path = indexed_path
+    try:
+        with Image.open(image_path) as image:
+            if max(image.size) >= OCR_DOWNSCALE_THRESHOLD:
+                image.thumbnail((OCR_MAX_SIDE, OCR_MAX_SIDE), Image.LANCZOS)
+            return page_num, pytesseract.image_to_string(image, config=OCR_CONFIG)
+    finally:
+        os.remove(image_path)
+
+def _map_pages(func, items):
+    """Apply func to every page item, across the extraction pool for larger documents.
+
+    Results are returned in page order.
+    """
+    items = list(items)
+    # Inside a file-level worker (see extract_upload_pages) the cores are already busy
+    if len(items) < PARALLEL_PAGE_THRESHOLD or multiprocessing.parent_process() is not None:
+        return [func(item) for item in items]
+    # One chunk per worker so shared arguments (the PDF bytes) are pickled once per process
+    chunksize = -(-len(items) // EXTRACTION_WORKERS)
+    return list(get_extraction_pool().map(func, items, chunksize=chunksize))
+
+@cache_pdf_text
+def robust_extract_text_from_pdf(pdf_path):
+    """Extract text from PDF using multiple methods for better reliability.
+
+    Methods are tried from cheapest to most expensive, stopping as soon as one
+    yields more than MIN_TEXT_LEN characters.
+    """
+    # Best (short) result so far, used if no method clears MIN_TEXT_LEN
+    fallback_text = []
+
+    # METHOD 1: Using PyMuPDF (native MuPDF text layer, much faster than PyPDF2)
+    text_layer_read = False
+    if USE_PYMUPDF:
+        try:
+            print(f"Trying PyMuPDF for {pdf_path}")
+            with fitz.open(pdf_path) as doc:
+                pdf_text = [f"Page {page_num+1}: {text}"
+                            for page_num, text in enumerate(page.get_text("text") for page in doc)
+                            if text and text.strip()]
+            text_layer_read = True
+
+            if len(''.join(pdf_text).strip()) > MIN_TEXT_LEN:
+                print(f"Successfully extracted text using PyMuPDF")
+                return pdf_text
+            fallback_text = pdf_text
+        except Exception as e:
+            print(f"Error with PyMuPDF: {str(e)}")
+
+    # METHOD 1b: Using PyPDF2 (pure Python; only when PyMuPDF is disabled or failed)
+    if not text_layer_read:
+        try:
+            print(f"Trying PyPDF2 for {pdf_path}")
+            with open(pdf_path, 'rb') as file:
+                pdf_bytes = file.read()
+            n_pages = len(PyPDF2.PdfReader(io.BytesIO(pdf_bytes)).pages)
+            results = _map_pages(partial(_extract_page, pdf_bytes), range(n_pages))
+            pdf_text = [f"Page {page_num+1}: {text}" for page_num, text in results if text and text.strip()]
+
+            if len(''.join(pdf_text).strip()) > MIN_TEXT_LEN:
+                print(f"Successfully extracted text using PyPDF2")
+                return pdf_text
+            fallback_text = pdf_text
+        except Exception as e:
+            print(f"Error with PyPDF2: {str(e)}")
+
+    # METHOD 2/3: Using unstructured, "fast" first, then the layout-model "hi_res" strategy
+    for strategy in ("fast", "hi_res"):
+        try:
+            print(f"Trying unstructured partition ({strategy}) for {pdf_path}")
+            try:
+                elements = partition_pdf(pdf_path, strategy=strategy)
+            except TypeError:
+                # If that fails, try with older version parameters
+                elements = partition_pdf(pdf_path)
+
+            all_text = [element.text for element in elements if getattr(element, 'text', None)]
+            if len(''.join(all_text).strip()) > MIN_TEXT_LEN:
+                print(f"Successfully extracted text using unstructured partition ({strategy})")
+                return all_text
+            if not fallback_text:
+                fallback_text = all_text
+        except Exception as e:
+            print(f"Error with unstructured partition ({strategy}): {str(e)}")
+
+    # METHOD 4: Using OCR if available
+    if PYTESSERACT_AVAILABLE:
+        try:
+            print(f"Trying OCR for {pdf_path}")
+            # Convert PDF to images and OCR
+            from pdf2image import convert_from_path
+
+            # Render pages to files in a temp folder and OCR them one by one from disk,
+            # so memory stays flat regardless of page count
+            with tempfile.TemporaryDirectory() as temp_dir:
+                image_paths = convert_from_path(
+                    pdf_path,
+                    dpi=OCR_DPI,
+                    thread_count=os.cpu_count() or 1,
+                    fmt='jpeg',
+                    output_folder=temp_dir,
+                    paths_only=True
+                )
+                with ThreadPoolExecutor(max_workers=OCR_WORKERS) as executor:
+                    results = list(executor.map(_ocr_page, enumerate(image_paths)))
+            ocr_text = [f"Page {i+1} (OCR): {text}" for i, text in results if text and text.strip()]
+
+            if ocr_text:
+                print(f"Successfully extracted text using OCR")
+                return ocr_text
+        except Exception as e:
+            print(f"Error with OCR: {str(e)}")
+
+    if fallback_text:
+        return fallback_text
+
+    print(f"Could not extract any text from {pdf_path}")
+    return []
+
+def extract_upload_pages(path, filename):
+    """Extract the pages of one saved PDF upload, then delete the file.
+
+    Runs in an extraction pool worker.
+
+    Returns:
+        List of (text, page) tuples for pages with more than 50 characters.
+    """
+    try:
+        extracted_texts = robust_extract_text_from_pdf(path)
+        return [(text, j + 1) for j, text in enumerate(extracted_texts) if text and len(text) > 50]
+    finally:
+        try:
+            os.remove(path)
+        except Exception as e:
+            print(f"Error removing temporary file {path}: {str(e)}")
+
+def dataset_pdf_chunks(path, filename, index):
+    """Extract the pages of one PDF uploaded to an existing dataset.
+
+    Runs in an extraction pool worker.
+
+    Returns:
+        List of (text, metadata, chunk_id) tuples for pages with more than 50 characters.
+    """
+    return [
+        (text, {"source": filename, "page": j + 1}, f"{filename}_{index}_{j}")
+        for j, text in enumerate(robust_extract_text_from_pdf(path))
+        if text and len(text) > 50
+    ]
@@ -12,7 +12,7 @@ from typing import List, Dict, Any, Optional, BinaryIO, Union
 from pathlib import Path
 
 from app.utils.encryption import DocumentEncryption, SecureTemporaryAccess
-from app.utils.document_processor import LegalDocumentProcessor
+from app.utils.document_processor import LegalDocumentProcessor, get_or_create_hnsw_collection
 
 class SecureDocumentProcessor:
     """Process documents securely in memory with encryption."""
@@ -22,7 +22,8 @@ class SecureDocumentProcessor:
         encryption_handler: Optional[DocumentEncryption] = None,
         embedding_model: str = "BAAI/bge-large-en-v1.5",
         chroma_path: Optional[str] = None,
-        device: str = "cpu"
+        device: str = "cpu",
+        doc_processor: Optional[LegalDocumentProcessor] = None
     ):
         """Initialize the secure document processor.
         
@@ -31,6 +32,8 @@ class SecureDocumentProcessor:
             embedding_model: Name of the embedding model
             chroma_path: Path to ChromaDB
             device: Device to use for embeddings
+            doc_processor: Optional existing document processor to share, so its
+                embedding model is not loaded a second time
         """
         # Set up encryption handler
         if encryption_handler is None:
@@ -46,12 +49,15 @@ class SecureDocumentProcessor:
         if chroma_path is None:
             chroma_path = os.path.join(base_dir, "data", "chroma")
         
-        # Initialize document processor with provided settings
-        self.doc_processor = LegalDocumentProcessor(
-            embedding_model=embedding_model,
-            chroma_path=chroma_path,
-            device=device
-        )
+        # Reuse the shared document processor, or initialize one with provided settings
+        if doc_processor is not None:
+            self.doc_processor = doc_processor
+        else:
+            self.doc_processor = LegalDocumentProcessor(
+                embedding_model=embedding_model,
+                chroma_path=chroma_path,
+                device=device
+            )
         
         # Configure logging
         logging.basicConfig(level=logging.INFO)
@@ -233,7 +239,7 @@ class SecureDocumentProcessor:
             ids.append(chunk_id)
         
         # Get ChromaDB collection
-        collection = self.doc_processor.chroma_client.get_or_create_collection(name=ragmodel_name)
+        collection = get_or_create_hnsw_collection(self.doc_processor.chroma_client, ragmodel_name)
         
         # Add chunks in batches
         batch_size = 100